@@ -1,14 +1,23 @@
-from flask import Flask, render_template, request, jsonify, session, redirect, url_for
+from flask import Flask, render_template, request, jsonify, session, redirect, url_for, abort, send_from_directory
 import psycopg2
 import json
 import os
-from datetime import datetime
+from datetime import datetime, date
+
+from collectors import (
+    test_postgres_connection, check_pg_stat_statements, get_databases_list, get_postgres_info,
+    get_key_metrics, get_table_statistics, get_full_detailed_metrics, get_problematic_queries,
+    get_performance_metrics, get_write_path_metrics, get_vacuum_metrics,
+)
+from snapshots import CONFIG_FILE, take_snapshot, save_snapshot, list_snapshot_days
+from reports import build_and_write, load_report, list_reports, is_valid_day, report_dir
+from archive import append_snapshot
+from plans import get_plan_index, load_plan, recently_changed
+from statements import RANKINGS
 
 app = Flask(__name__)
 app.secret_key = 'your-secret-key-here'
 
-CONFIG_FILE = 'config.json'
-
 # Кастомные фильтры для шаблонов
 @app.template_filter('number_format')
 def number_format(value):
@@ -20,12 +29,49 @@ def number_format(value):
     except (ValueError, TypeError):
         return str(value)
 
+@app.template_filter('size_format')
+def size_format(value):
+    """Форматирует количество байт в KB/MB/GB"""
+    try:
+        if value is None:
+            return "—"
+        value = float(value)
+        for unit in ('B', 'KB', 'MB', 'GB'):
+            if abs(value) < 1024:
+                return f"{value:.1f} {unit}"
+            value /= 1024
+        return f"{value:.1f} TB"
+    except (ValueError, TypeError):
+        return str(value)
+
+@app.template_filter('duration_format')
+def duration_format(seconds):
+    """Форматирует длительность в секундах как 2д 3ч / 5ч 10м / 40с"""
+    try:
+        if seconds is None or seconds == float('inf'):
+            return "—"
+        seconds = int(seconds)
+        if seconds >= 86400:
+            return f"{seconds // 86400}д {seconds % 86400 // 3600}ч"
+        if seconds >= 3600:
+            return f"{seconds // 3600}ч {seconds % 3600 // 60}м"
+        if seconds >= 60:
+            return f"{seconds // 60}м {seconds % 60}с"
+        return f"{seconds}с"
+    except (ValueError, TypeError, OverflowError):
+        return str(seconds)
+
 @app.template_filter('tojson')
 def tojson_filter(obj):
     """Фильтр для отображения JSON в шаблоне"""
     import json
     return json.dumps(obj, indent=2, ensure_ascii=False, default=str)
 
+@app.template_filter('recently_changed')
+def recently_changed_filter(statement):
+    """Отметка о недавней смене плана запроса"""
+    return recently_changed(statement)
+
 def load_config():
     """Загрузка конфигурации из файла"""
     try:
@@ -53,471 +99,6 @@ def save_config(config):
         print(f"Ошибка сохранения конфигурации: {e}")
         return False
 
-def test_postgres_connection(connection_string):
-    """Тестирование подключения к PostgreSQL"""
-    try:
-        conn = psycopg2.connect(connection_string)
-        conn.close()
-        return True, "Подключение успешно!"
-    except Exception as e:
-        return False, f"Ошибка подключения: {str(e)}"
-
-def check_pg_stat_statements(connection_string):
-    """Проверка наличия расширения pg_stat_statements"""
-    try:
-        conn = psycopg2.connect(connection_string)
-        cursor = conn.cursor()
-        
-        cursor.execute("SELECT * FROM pg_extension WHERE extname = 'pg_stat_statements';")
-        result = cursor.fetchone()
-        
-        cursor.close()
-        conn.close()
-        
-        return result is not None
-    except Exception as e:
-        print(f"Ошибка при проверке расширения pg_stat_statements: {e}")
-        return False
-
-def get_databases_list(connection_string):
-    """Получение списка всех баз данных"""
-    try:
-        base_conn_string = connection_string.replace("dbname='postgres'", "dbname='postgres'")
-        conn = psycopg2.connect(base_conn_string)
-        cursor = conn.cursor()
-        
-        cursor.execute("""
-            SELECT datname 
-            FROM pg_database 
-            WHERE datistemplate = false 
-            AND datname NOT LIKE 'template%'
-            ORDER BY datname;
-        """)
-        
-        databases = [row[0] for row in cursor.fetchall()]
-        cursor.close()
-        conn.close()
-        
-        return databases
-    except Exception as e:
-        print(f"Ошибка при получении списка БД: {e}")
-        return []
-
-def get_postgres_info(connection_string):
-    """Получение информации о PostgreSQL"""
-    try:
-        conn = psycopg2.connect(connection_string)
-        cursor = conn.cursor()
-        
-        cursor.execute("SELECT version();")
-        version = cursor.fetchone()[0]
-        
-        cursor.execute("SELECT pg_postmaster_start_time();")
-        start_time = cursor.fetchone()[0]
-        
-        cursor.execute("SELECT pg_current_wal_lsn();")
-        wal_lsn = cursor.fetchone()[0]
-        
-        # Проверяем наличие расширения
-        has_pg_stat_statements = check_pg_stat_statements(connection_string)
-        
-        cursor.close()
-        conn.close()
-        
-        return {
-            'version': version,
-            'start_time': start_time.strftime('%Y-%m-%d %H:%M:%S'),
-            'wal_lsn': wal_lsn,
-            'has_pg_stat_statements': has_pg_stat_statements,
-            'success': True
-        }
-    except Exception as e:
-        return {
-            'success': False,
-            'error': str(e)
-        }
-
-def get_key_metrics(connection_string):
-    """Получение ключевых метрик базы данных"""
-    try:
-        conn = psycopg2.connect(connection_string)
-        cursor = conn.cursor()
-        
-        query = """
-        SELECT 
-            datname,
-            numbackends as connections,
-            xact_commit as commits,
-            xact_rollback as rollbacks,
-            blks_read as disk_reads,
-            blks_hit as cache_hits,
-            tup_returned as rows_returned,
-            tup_fetched as rows_fetched,
-            tup_inserted as rows_inserted,
-            tup_updated as rows_updated,
-            tup_deleted as rows_deleted
-        FROM pg_stat_database 
-        WHERE datname = current_database();
-        """
-        
-        cursor.execute(query)
-        columns = [desc[0] for desc in cursor.description]
-        result = cursor.fetchone()
-        
-        cursor.close()
-        conn.close()
-        
-        if result:
-            metrics = dict(zip(columns, result))
-            
-            total_reads = metrics['disk_reads'] + metrics['cache_hits']
-            if total_reads > 0:
-                metrics['cache_hit_ratio'] = round((metrics['cache_hits'] / total_reads) * 100, 2)
-            else:
-                metrics['cache_hit_ratio'] = 0
-                
-            total_transactions = metrics['commits'] + metrics['rollbacks']
-            if total_transactions > 0:
-                metrics['rollback_ratio'] = round((metrics['rollbacks'] / total_transactions) * 100, 2)
-            else:
-                metrics['rollback_ratio'] = 0
-                
-            metrics['success'] = True
-            return metrics
-        else:
-            return {'success': False, 'error': 'No data found'}
-            
-    except Exception as e:
-        return {
-            'success': False,
-            'error': str(e)
-        }
-
-def get_table_statistics(connection_string):
-    """Получение статистики по таблицам"""
-    try:
-        conn = psycopg2.connect(connection_string)
-        cursor = conn.cursor()
-        
-        query = """
-        SELECT 
-            schemaname,
-            relname as table_name,
-            COALESCE(NULLIF(seq_scan::text, '')::bigint, 0) as sequential_scans,
-            COALESCE(NULLIF(seq_tup_read::text, '')::bigint, 0) as seq_rows_read,
-            COALESCE(NULLIF(idx_scan::text, '')::bigint, 0) as index_scans,
-            COALESCE(NULLIF(idx_tup_fetch::text, '')::bigint, 0) as index_rows_fetched,
-            COALESCE(NULLIF(n_tup_ins::text, '')::bigint, 0) as inserts,
-            COALESCE(NULLIF(n_tup_upd::text, '')::bigint, 0) as updates,
-            COALESCE(NULLIF(n_tup_del::text, '')::bigint, 0) as deletes,
-            COALESCE(NULLIF(n_tup_hot_upd::text, '')::bigint, 0) as hot_updates,
-            COALESCE(NULLIF(n_live_tup::text, '')::bigint, 0) as live_rows,
-            COALESCE(NULLIF(n_dead_tup::text, '')::bigint, 0) as dead_rows
-        FROM pg_stat_all_tables
-        WHERE schemaname NOT LIKE 'pg_%' 
-        ORDER BY COALESCE(NULLIF(n_dead_tup::text, '')::bigint, 0) DESC;
-        """
-        
-        cursor.execute(query)
-        columns = [desc[0] for desc in cursor.description]
-        results = cursor.fetchall()
-        
-        cursor.close()
-        conn.close()
-        
-        if results:
-            tables = []
-            for row in results:
-                table_data = dict(zip(columns, row))
-                
-                sequential_scans = table_data['sequential_scans']
-                index_scans = table_data['index_scans']
-                total_scans = sequential_scans + index_scans
-                
-                if total_scans > 0:
-                    table_data['index_scan_ratio'] = round((index_scans / total_scans) * 100, 2)
-                else:
-                    table_data['index_scan_ratio'] = 0
-                    
-                live_rows = table_data['live_rows']
-                dead_rows = table_data['dead_rows']
-                total_rows = live_rows + dead_rows
-                
-                if total_rows > 0:
-                    table_data['dead_row_ratio'] = round((dead_rows / total_rows) * 100, 2)
-                else:
-                    table_data['dead_row_ratio'] = 0
-                    
-                tables.append(table_data)
-            
-            return {
-                'tables': tables,
-                'total_tables': len(tables),
-                'success': True
-            }
-        else:
-            return {'success': False, 'error': 'No table statistics found'}
-            
-    except Exception as e:
-        return {
-            'success': False,
-            'error': str(e)
-        }
-
-def get_full_detailed_metrics(connection_string):
-    """Получение полной детальной статистики"""
-    try:
-        conn = psycopg2.connect(connection_string)
-        cursor = conn.cursor()
-        
-        # Комплексный запрос с множеством метрик
-        query = """
-        SELECT 
-            -- Базовая информация
-            current_database() as database_name,
-            current_user as current_user,
-            inet_server_addr() as server_address,
-            inet_server_port() as server_port,
-            
-            -- Статистика базы данных
-            (SELECT count(*) FROM pg_stat_activity) as total_connections,
-            (SELECT count(*) FROM pg_stat_activity WHERE state = 'active') as active_connections,
-            (SELECT count(*) FROM pg_stat_activity WHERE state = 'idle') as idle_connections,
-            
-            -- Размер базы данных
-            pg_database_size(current_database()) as database_size_bytes,
-            
-            -- Статистика транзакций
-            xact_commit as total_commits,
-            xact_rollback as total_rollbacks,
-            
-            -- Статистика ввода/вывода
-            blks_read as blocks_read,
-            blks_hit as blocks_hit,
-            
-            -- Статистика запросов
-            tup_returned as tuples_returned,
-            tup_fetched as tuples_fetched,
-            tup_inserted as tuples_inserted,
-            tup_updated as tuples_updated,
-            tup_deleted as tuples_deleted,
-            
-            -- Время работы
-            (SELECT extract(epoch from now() - pg_postmaster_start_time())) as uptime_seconds,
-            
-            -- Настройки
-            (SELECT setting FROM pg_settings WHERE name = 'shared_buffers') as shared_buffers,
-            (SELECT setting FROM pg_settings WHERE name = 'work_mem') as work_mem,
-            (SELECT setting FROM pg_settings WHERE name = 'maintenance_work_mem') as maintenance_work_mem
-            
-        FROM pg_stat_database 
-        WHERE datname = current_database();
-        """
-        
-        cursor.execute(query)
-        columns = [desc[0] for desc in cursor.description]
-        result = cursor.fetchone()
-        
-        cursor.close()
-        conn.close()
-        
-        if result:
-            metrics = dict(zip(columns, result))
-            
-            # Рассчитываем дополнительные метрики
-            if metrics['blocks_read'] + metrics['blocks_hit'] > 0:
-                metrics['cache_hit_ratio'] = round((metrics['blocks_hit'] / (metrics['blocks_read'] + metrics['blocks_hit'])) * 100, 2)
-            else:
-                metrics['cache_hit_ratio'] = 0
-                
-            if metrics['total_commits'] + metrics['total_rollbacks'] > 0:
-                metrics['rollback_ratio'] = round((metrics['total_rollbacks'] / (metrics['total_commits'] + metrics['total_rollbacks'])) * 100, 2)
-            else:
-                metrics['rollback_ratio'] = 0
-                
-            # Форматируем размер базы данных
-            metrics['database_size_mb'] = round(metrics['database_size_bytes'] / (1024 * 1024), 2)
-            metrics['database_size_gb'] = round(metrics['database_size_bytes'] / (1024 * 1024 * 1024), 2)
-            
-            metrics['success'] = True
-            return metrics
-        else:
-            return {'success': False, 'error': 'No detailed metrics found'}
-            
-    except Exception as e:
-        return {
-            'success': False,
-            'error': str(e)
-        }
-
-def get_problematic_queries(connection_string):
-    """Поиск проблемных запросов через pg_stat_statements"""
-    try:
-        conn = psycopg2.connect(connection_string)
-        cursor = conn.cursor()
-        
-        # Проверяем наличие расширения
-        if not check_pg_stat_statements(connection_string):
-            return {'success': False, 'error': 'Расширение pg_stat_statements не установлено'}
-        
-        query = """
-        SELECT 
-            query,
-            calls as total_calls,
-            total_exec_time as total_time,
-            mean_exec_time as avg_time,
-            rows as rows_processed,
-            shared_blks_hit as cache_hits,
-            shared_blks_read as disk_reads,
-            100.0 * shared_blks_hit / nullif(shared_blks_hit + shared_blks_read, 0) as cache_hit_ratio
-        FROM pg_stat_statements 
-        WHERE query NOT LIKE '%pg_stat_statements%'
-        ORDER BY total_exec_time DESC
-        LIMIT 50;
-        """
-        
-        cursor.execute(query)
-        columns = [desc[0] for desc in cursor.description]
-        results = cursor.fetchall()
-        
-        cursor.close()
-        conn.close()
-        
-        if results:
-            queries = []
-            for row in results:
-                query_data = dict(zip(columns, row))
-                
-                # Форматируем запрос для лучшего отображения
-                if query_data['query']:
-                    query_data['short_query'] = query_data['query'][:100] + '...' if len(query_data['query']) > 100 else query_data['query']
-                
-                queries.append(query_data)
-            
-            return {
-                'queries': queries,
-                'total_queries': len(queries),
-                'success': True
-            }
-        else:
-            return {'success': False, 'error': 'No query statistics found'}
-            
-    except Exception as e:
-        return {
-            'success': False,
-            'error': str(e)
-        }
-
-def get_performance_metrics(connection_string):
-    """Мониторинг производительности"""
-    try:
-        conn = psycopg2.connect(connection_string)
-        cursor = conn.cursor()
-        
-        # Комплексные метрики производительности
-        query = """
-        WITH db_stats AS (
-            SELECT 
-                datname,
-                xact_commit,
-                xact_rollback,
-                blks_read,
-                blks_hit,
-                tup_returned,
-                tup_fetched,
-                tup_inserted,
-                tup_updated,
-                tup_deleted
-            FROM pg_stat_database 
-            WHERE datname = current_database()
-        ),
-        table_stats AS (
-            SELECT 
-                count(*) as total_tables,
-                sum(n_live_tup) as total_live_rows,
-                sum(n_dead_tup) as total_dead_rows,
-                sum(seq_scan) as total_seq_scans,
-                sum(idx_scan) as total_idx_scans
-            FROM pg_stat_all_tables 
-            WHERE schemaname NOT LIKE 'pg_%'
-        ),
-        index_stats AS (
-            SELECT 
-                count(*) as total_indexes,
-                sum(idx_scan) as total_index_scans
-            FROM pg_stat_all_indexes
-        ),
-        connection_stats AS (
-            SELECT 
-                count(*) as total_connections,
-                count(*) FILTER (WHERE state = 'active') as active_connections
-            FROM pg_stat_activity
-            WHERE datname = current_database()
-        )
-        SELECT 
-            -- Статистика БД
-            d.xact_commit as commits,
-            d.xact_rollback as rollbacks,
-            d.blks_read as disk_reads,
-            d.blks_hit as cache_hits,
-            
-            -- Статистика таблиц
-            t.total_tables,
-            t.total_live_rows,
-            t.total_dead_rows,
-            t.total_seq_scans,
-            t.total_idx_scans,
-            
-            -- Статистика индексов
-            i.total_indexes,
-            i.total_index_scans,
-            
-            -- Статистика подключений
-            c.total_connections,
-            c.active_connections,
-            
-            -- Расчетные метрики
-            CASE 
-                WHEN (d.blks_read + d.blks_hit) > 0 THEN 
-                    round(100.0 * d.blks_hit / (d.blks_read + d.blks_hit), 2)
-                ELSE 0 
-            END as cache_hit_ratio,
-            
-            CASE 
-                WHEN (t.total_seq_scans + t.total_idx_scans) > 0 THEN 
-                    round(100.0 * t.total_idx_scans / (t.total_seq_scans + t.total_idx_scans), 2)
-                ELSE 0 
-            END as index_usage_ratio,
-            
-            CASE 
-                WHEN (t.total_live_rows + t.total_dead_rows) > 0 THEN 
-                    round(100.0 * t.total_dead_rows / (t.total_live_rows + t.total_dead_rows), 2)
-                ELSE 0 
-            END as dead_rows_ratio
-            
-        FROM db_stats d, table_stats t, index_stats i, connection_stats c;
-        """
-        
-        cursor.execute(query)
-        columns = [desc[0] for desc in cursor.description]
-        result = cursor.fetchone()
-        
-        cursor.close()
-        conn.close()
-        
-        if result:
-            metrics = dict(zip(columns, result))
-            metrics['success'] = True
-            return metrics
-        else:
-            return {'success': False, 'error': 'No performance metrics found'}
-            
-    except Exception as e:
-        return {
-            'success': False,
-            'error': str(e)
-        }
-
 # Маршруты
 @app.route('/')
 def index():
@@ -711,7 +292,17 @@ def find_problematic_queries():
     
     if 'postgres' in config and 'connection_string' in config['postgres']:
         connection_string = config['postgres']['connection_string']
-        queries_data = get_problematic_queries(connection_string)
+        # Рейтинг, фильтры и страница меняются без запроса к серверу: снимок обновляется
+        # по кнопке «Обновить» или когда устарел
+        queries_data = get_problematic_queries(
+            connection_string,
+            ranking=request.args.get('ranking', 'total_time'),
+            dbid=request.args.get('dbid', type=int),
+            userid=request.args.get('userid', type=int),
+            pattern=request.args.get('pattern', '').strip() or None,
+            page=request.args.get('page', 1, type=int),
+            refresh=bool(request.args.get('refresh')),
+        )
         has_pg_stat_statements = config['postgres'].get('has_pg_stat_statements', False)
     
     from datetime import datetime
@@ -719,10 +310,34 @@ def find_problematic_queries():
     
     return render_template('find_problematic_queries.html', 
                          queries_data=queries_data,
+                         rankings={name: ranking[0] for name, ranking in RANKINGS.items()},
+                         filters={key: request.args.get(key) for key in ('ranking', 'dbid', 'userid', 'pattern') if request.args.get(key)},
+                         plan_index=get_plan_index()['statements'],
                          connected='postgres' in config,
                          now=now,
                          has_pg_stat_statements=has_pg_stat_statements)
 
+@app.route('/plans/<int(signed=True):queryid>')
+def query_plan(queryid):
+    """Просмотр сохранённых планов: только из кэша, без EXPLAIN на сервере"""
+    config = load_config()
+    has_pg_stat_statements = config.get('postgres', {}).get('has_pg_stat_statements', False)
+
+    statement = get_plan_index()['statements'].get(str(queryid))
+    plan = None
+    previous_plan = None
+    if statement and statement.get('plan_hash'):
+        plan = load_plan(queryid, request.args.get('hash') or statement['plan_hash'])
+        if statement.get('previous_hash'):
+            previous_plan = load_plan(queryid, statement['previous_hash'])
+
+    return render_template('query_plan.html',
+                         queryid=queryid,
+                         statement=statement,
+                         plan=plan,
+                         previous_plan=previous_plan,
+                         has_pg_stat_statements=has_pg_stat_statements)
+
 @app.route('/performance_monitoring')
 def performance_monitoring():
     config = load_config()
@@ -743,6 +358,44 @@ def performance_monitoring():
                          now=now,
                          has_pg_stat_statements=has_pg_stat_statements)
 
+@app.route('/write_path')
+def write_path():
+    config = load_config()
+    write_path_data = None
+    has_pg_stat_statements = False
+
+    if 'postgres' in config and 'connection_string' in config['postgres']:
+        connection_string = config['postgres']['connection_string']
+        write_path_data = get_write_path_metrics(connection_string)
+        has_pg_stat_statements = config['postgres'].get('has_pg_stat_statements', False)
+
+    now = datetime.now()
+
+    return render_template('write_path.html',
+                         write_path_data=write_path_data,
+                         connected='postgres' in config,
+                         now=now,
+                         has_pg_stat_statements=has_pg_stat_statements)
+
+@app.route('/vacuum')
+def vacuum():
+    config = load_config()
+    vacuum_data = None
+    has_pg_stat_statements = False
+
+    if 'postgres' in config and 'connection_string' in config['postgres']:
+        connection_string = config['postgres']['connection_string']
+        vacuum_data = get_vacuum_metrics(connection_string)
+        has_pg_stat_statements = config['postgres'].get('has_pg_stat_statements', False)
+
+    now = datetime.now()
+
+    return render_template('vacuum.html',
+                         vacuum_data=vacuum_data,
+                         connected='postgres' in config,
+                         now=now,
+                         has_pg_stat_statements=has_pg_stat_statements)
+
 @app.route('/debug_database')
 def debug_database():
     """Временный маршрут для отладки"""
@@ -808,7 +461,64 @@ def settings():
 def reports():
     config = load_config()
     has_pg_stat_statements = config.get('postgres', {}).get('has_pg_stat_statements', False)
-    return render_template('reports.html', has_pg_stat_statements=has_pg_stat_statements)
+
+    # Отчёты читаются только из готовых файлов, запросов к серверу здесь нет
+    report_days = list_reports()
+    selected_day = request.args.get('day') or (report_days[0] if report_days else None)
+    report = None
+    if selected_day and is_valid_day(selected_day):
+        report = load_report(selected_day)
+
+    message = None
+    if request.args.get('message'):
+        message = {
+            'success': request.args.get('status') == 'ok',
+            'text': request.args.get('message')
+        }
+
+    return render_template('reports.html',
+                         report=report,
+                         report_days=report_days,
+                         snapshot_days=list_snapshot_days(),
+                         selected_day=selected_day,
+                         today=date.today().isoformat(),
+                         message=message,
+                         connected='postgres' in config,
+                         has_pg_stat_statements=has_pg_stat_statements)
+
+@app.route('/reports/snapshot', methods=['POST'])
+def take_report_snapshot():
+    config = load_config()
+
+    if 'postgres' not in config or 'connection_string' not in config['postgres']:
+        return redirect(url_for('reports', status='error', message='Подключение не настроено'))
+
+    snapshot = take_snapshot(config['postgres']['connection_string'])
+    if not snapshot['success']:
+        return redirect(url_for('reports', status='error', message=f"Ошибка снятия снимка: {snapshot['error']}"))
+    if not save_snapshot(snapshot):
+        return redirect(url_for('reports', status='error', message='Ошибка сохранения снимка'))
+    append_snapshot(snapshot)
+
+    return redirect(url_for('reports', status='ok', message=f"Снимок сохранён: {snapshot['ts'][:19]}"))
+
+@app.route('/reports/build', methods=['POST'])
+def build_report():
+    day = request.form.get('day', date.today().isoformat())
+    if not is_valid_day(day):
+        return redirect(url_for('reports', status='error', message=f'Некорректный день: {day}'))
+
+    report = build_and_write(day)
+    if not report['success']:
+        return redirect(url_for('reports', day=day, status='error', message=report['error']))
+
+    return redirect(url_for('reports', day=day, status='ok', message=f'Отчёт за {day} построен'))
+
+@app.route('/reports/<day>/<filename>')
+def report_file(day, filename):
+    if not is_valid_day(day) or filename not in ('report.html', 'report.json'):
+        abort(404)
+    return send_from_directory(os.path.abspath(report_dir(day)), filename)
 
 @app.route('/logout')
 def logout():
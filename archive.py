@@ -0,0 +1,400 @@
+import argparse
+import json
+import os
+from collections import OrderedDict
+from contextlib import contextmanager
+from datetime import datetime, timedelta, timezone
+
+import numpy as np
+
+from snapshots import DATA_DIR, load_snapshots, list_snapshot_days
+
+ARCHIVE_DIR = os.path.join(DATA_DIR, 'archive')
+QUERYIDS_FILE = os.path.join(ARCHIVE_DIR, 'queryids.i8')
+QUERIES_FILE = os.path.join(ARCHIVE_DIR, 'queries.ndjson')
+# Архив пополняют и веб-интерфейс, и collector.py: дозапись идёт под блокировкой файла
+LOCK_FILE = os.path.join(ARCHIVE_DIR, '.lock')
+
+# Счётчики pg_stat_statements из sql/1x_pg_stat_statements.sql и их типы в архиве
+COLUMNS = {
+    'calls': np.int64,
+    'total_exec_time': np.float64,
+    'min_exec_time': np.float64,
+    'max_exec_time': np.float64,
+    'mean_exec_time': np.float64,
+    'stddev_exec_time': np.float64,
+    'rows': np.int64,
+    'shared_blks_hit': np.int64,
+    'shared_blks_read': np.int64,
+    'shared_blks_dirtied': np.int64,
+    'shared_blks_written': np.int64,
+    'local_blks_hit': np.int64,
+    'local_blks_read': np.int64,
+    'local_blks_dirtied': np.int64,
+    'local_blks_written': np.int64,
+    'temp_blks_read': np.int64,
+    'temp_blks_written': np.int64,
+}
+
+# Значения за всё время, а не накопительные счётчики: приращение для них не имеет смысла
+GAUGE_COLUMNS = ('min_exec_time', 'max_exec_time', 'mean_exec_time', 'stddev_exec_time')
+
+# Метрики для рейтингов по приращению: накопительные счётчики и сумма нескольких колонок
+IO_COLUMNS = (
+    'shared_blks_read', 'shared_blks_written',
+    'local_blks_read', 'local_blks_written',
+    'temp_blks_read', 'temp_blks_written',
+)
+METRICS = {name: (name,) for name in COLUMNS if name not in GAUGE_COLUMNS}
+METRICS['io_blocks'] = IO_COLUMNS
+
+# Индекс времени сегмента: на каждый снимок пара (время в мс UTC, конец строк снимка)
+TIME_INDEX_DTYPE = np.dtype([('ts', np.int64), ('row_end', np.int64)])
+
+# Словарь queryid -> номер в архиве (номер хранится в колонке qid как int32)
+_queryid_index = None
+# Кэш отображённых в память колонок: (день, колонка) -> (число строк, memmap).
+# Каждый memmap держит открытый дескриптор файла, поэтому кэш ограничен (LRU)
+COLUMN_CACHE_SIZE = 48
+_column_cache = OrderedDict()
+
+def ts_to_ms(value):
+    """Время снимка (ISO-строка или datetime) в миллисекунды UTC"""
+    if isinstance(value, str):
+        value = datetime.fromisoformat(value)
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=timezone.utc)
+    return int(value.timestamp() * 1000)
+
+def ms_to_datetime(value):
+    return datetime.fromtimestamp(int(value) / 1000, tz=timezone.utc)
+
+def segment_dir(day):
+    return os.path.join(ARCHIVE_DIR, day)
+
+def column_path(day, name):
+    return os.path.join(segment_dir(day), f"{name}.col")
+
+def time_index_path(day):
+    return os.path.join(segment_dir(day), 'time.idx')
+
+def map_array(path, dtype, count=None):
+    """Отображение файла в память как массив NumPy (без копирования данных)"""
+    dtype = np.dtype(dtype)
+    if not os.path.exists(path):
+        return np.empty(0, dtype=dtype)
+    available = os.path.getsize(path) // dtype.itemsize
+    count = available if count is None else min(count, available)
+    if count == 0:
+        return np.empty(0, dtype=dtype)
+    return np.memmap(path, dtype=dtype, mode='r', shape=(count,))
+
+def load_queryid_index():
+    """Словарь queryid -> qid; дочитывает записи, добавленные другими процессами"""
+    global _queryid_index
+    if _queryid_index is None:
+        _queryid_index = {}
+    queryids = map_array(QUERYIDS_FILE, np.int64)
+    for qid in range(len(_queryid_index), len(queryids)):
+        _queryid_index[int(queryids[qid])] = qid
+    return _queryid_index
+
+def load_queryids():
+    """Массив queryid по номеру qid"""
+    return map_array(QUERYIDS_FILE, np.int64)
+
+@contextmanager
+def archive_lock():
+    """Эксклюзивная блокировка архива между процессами: fcntl, на Windows — msvcrt"""
+    os.makedirs(ARCHIVE_DIR, exist_ok=True)
+    with open(LOCK_FILE, 'a+') as f:
+        if os.name == 'nt':
+            import msvcrt
+
+            f.seek(0)
+            while True:
+                try:
+                    # LK_LOCK ждёт освобождения около 10 секунд, затем бросает OSError
+                    msvcrt.locking(f.fileno(), msvcrt.LK_LOCK, 1)
+                    break
+                except OSError:
+                    continue
+            try:
+                yield
+            finally:
+                f.seek(0)
+                msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
+        else:
+            import fcntl
+
+            # Блокировка снимается при закрытии файла
+            fcntl.flock(f, fcntl.LOCK_EX)
+            yield
+
+def append_snapshot(snapshot):
+    """Дописывание строк pg_stat_statements из снимка в сегмент его дня"""
+    statements = [row for row in snapshot.get('statements', []) if row.get('queryid') is not None]
+    if not statements:
+        return False
+
+    try:
+        with archive_lock():
+            return append_locked(snapshot, statements)
+    except Exception as e:
+        print(f"Ошибка записи снимка в архив: {e}")
+        return False
+
+def append_locked(snapshot, statements):
+    """Дозапись снимка; вызывается только под блокировкой LOCK_FILE"""
+    day = snapshot['ts'][:10]
+    ts = ts_to_ms(snapshot['ts'])
+    os.makedirs(segment_dir(day), exist_ok=True)
+
+    time_index = map_array(time_index_path(day), TIME_INDEX_DTYPE)
+    if len(time_index) and ts <= time_index[-1]['ts']:
+        # Снимок уже в архиве (например, повторный импорт)
+        return False
+    row_start = int(time_index[-1]['row_end']) if len(time_index) else 0
+
+    index = load_queryid_index()
+    new_queries = {}
+    for row in statements:
+        queryid = int(row['queryid'])
+        if queryid not in index and queryid not in new_queries:
+            new_queries[queryid] = row.get('query') or ''
+
+    if new_queries:
+        with open(QUERYIDS_FILE, 'ab') as f:
+            f.write(np.fromiter(new_queries, dtype=np.int64, count=len(new_queries)).tobytes())
+        with open(QUERIES_FILE, 'a', encoding='utf-8') as f:
+            for queryid, query in new_queries.items():
+                f.write(json.dumps({'queryid': queryid, 'query': query}, ensure_ascii=False) + '\n')
+        index = load_queryid_index()
+
+    qid = np.fromiter((index[int(row['queryid'])] for row in statements), dtype=np.int32, count=len(statements))
+    order = np.argsort(qid, kind='stable')
+
+    # Строки, недописанные при сбое, отсекаются по row_end из индекса времени
+    write_column(day, 'qid', qid[order], row_start)
+    for name, dtype in COLUMNS.items():
+        values = np.fromiter((row.get(name) or 0 for row in statements), dtype=dtype, count=len(statements))
+        write_column(day, name, values[order], row_start)
+
+    # Запись в индекс времени последней: после неё снимок виден читателям
+    entry = np.array([(ts, row_start + len(statements))], dtype=TIME_INDEX_DTYPE)
+    with open(time_index_path(day), 'ab') as f:
+        f.write(entry.tobytes())
+    return True
+
+def write_column(day, name, values, row_start):
+    """Запись значений колонки с позиции row_start"""
+    path = column_path(day, name)
+    mode = 'r+b' if os.path.exists(path) else 'wb'
+    with open(path, mode) as f:
+        f.seek(row_start * values.dtype.itemsize)
+        f.write(values.tobytes())
+        f.truncate()
+
+def list_segments():
+    """Дни, за которые есть сегменты архива (по возрастанию)"""
+    if not os.path.isdir(ARCHIVE_DIR):
+        return []
+    return sorted(name for name in os.listdir(ARCHIVE_DIR) if os.path.isdir(segment_dir(name)))
+
+def load_time_index(day):
+    return map_array(time_index_path(day), TIME_INDEX_DTYPE)
+
+def load_column(day, name, rows):
+    """Колонка сегмента как memmap; кэшируется (LRU), пока не изменится число строк"""
+    key = (day, name)
+    cached = _column_cache.get(key)
+    if cached and cached[0] == rows:
+        _column_cache.move_to_end(key)
+        return cached[1]
+    dtype = np.int32 if name == 'qid' else COLUMNS[name]
+    column = map_array(column_path(day, name), dtype, rows)
+    _column_cache[key] = (rows, column)
+    _column_cache.move_to_end(key)
+    while len(_column_cache) > COLUMN_CACHE_SIZE:
+        _column_cache.popitem(last=False)
+    return column
+
+def snapshot_rows(time_index, position):
+    """Диапазон строк снимка с номером position в сегменте"""
+    start = int(time_index[position - 1]['row_end']) if position > 0 else 0
+    return start, int(time_index[position]['row_end'])
+
+def find_snapshots(start_ms, end_ms):
+    """Снимки в интервале [start_ms, end_ms]: список (день, индекс времени, позиции)"""
+    found = []
+    for day in list_segments():
+        time_index = load_time_index(day)
+        if not len(time_index):
+            continue
+        if time_index[-1]['ts'] < start_ms or time_index[0]['ts'] > end_ms:
+            continue
+        ts = time_index['ts']
+        first = int(np.searchsorted(ts, start_ms, side='left'))
+        last = int(np.searchsorted(ts, end_ms, side='right'))
+        if first < last:
+            found.append((day, time_index, range(first, last)))
+    return found
+
+def metric_values(day, time_index, position, columns, size):
+    """Значения колонок одного снимка, разложенные по qid в массивы длины size"""
+    row_start, row_end = snapshot_rows(time_index, position)
+    rows = int(time_index[-1]['row_end'])
+    qid = load_column(day, 'qid', rows)[row_start:row_end]
+
+    # bincount суммирует строки одного queryid разных пользователей/баз
+    return {name: np.bincount(qid, weights=load_column(day, name, rows)[row_start:row_end], minlength=size)
+            for name in columns}
+
+def top_by_delta(start, end, metric='total_exec_time', limit=20):
+    """Топ queryid по приращению метрики за интервал (сумма приростов между соседними снимками)"""
+    if metric not in METRICS:
+        return {'success': False, 'error': f'Неизвестная метрика: {metric}'}
+
+    found = find_snapshots(ts_to_ms(start), ts_to_ms(end))
+    if not found:
+        return {'success': False, 'error': 'Нет снимков в указанном интервале'}
+
+    queryids = load_queryids()
+    size = len(queryids)
+    columns = METRICS[metric]
+    first_day, first_index, first_positions = found[0]
+    last_day, last_index, last_positions = found[-1]
+
+    delta = np.zeros(size, dtype=np.float64)
+    previous = None
+    for day, time_index, positions in found:
+        for position in positions:
+            current = metric_values(day, time_index, position, columns, size)
+            if previous is not None:
+                for name in columns:
+                    # Как в отчётах: сброс статистики или новый запрос — приращение с нуля,
+                    # запрос, пропавший из снимка, даёт 0
+                    delta += np.where(current[name] >= previous[name],
+                                      current[name] - previous[name], current[name])
+            previous = current
+
+    limit = min(limit, size)
+    if limit <= 0:
+        return {'success': False, 'error': 'Архив запросов пуст'}
+    candidates = np.argpartition(delta, size - limit)[size - limit:]
+    candidates = candidates[np.argsort(delta[candidates])[::-1]]
+    candidates = candidates[delta[candidates] > 0]
+
+    return {
+        'metric': metric,
+        'from': ms_to_datetime(first_index[first_positions[0]]['ts']).isoformat(),
+        'to': ms_to_datetime(last_index[last_positions[-1]]['ts']).isoformat(),
+        'top': [{'queryid': int(queryids[qid]), 'delta': float(delta[qid])} for qid in candidates],
+        'success': True
+    }
+
+def series(queryid, start, end, columns=('calls', 'total_exec_time')):
+    """Значения колонок по одному queryid во всех снимках интервала"""
+    qid = load_queryid_index().get(int(queryid))
+    if qid is None:
+        return {'success': False, 'error': f'queryid {queryid} нет в архиве'}
+
+    timestamps = []
+    values = {name: [] for name in columns}
+    for day, time_index, positions in find_snapshots(ts_to_ms(start), ts_to_ms(end)):
+        rows = int(time_index[-1]['row_end'])
+        qid_column = load_column(day, 'qid', rows)
+        for position in positions:
+            row_start, row_end = snapshot_rows(time_index, position)
+            # Строки снимка отсортированы по qid; строки разных пользователей/баз суммируются
+            snapshot_qids = qid_column[row_start:row_end]
+            left = row_start + int(np.searchsorted(snapshot_qids, qid, side='left'))
+            right = row_start + int(np.searchsorted(snapshot_qids, qid, side='right'))
+            if left == right:
+                continue
+            timestamps.append(time_index[position]['ts'])
+            for name in columns:
+                values[name].append(load_column(day, name, rows)[left:right].sum())
+
+    return {
+        'queryid': int(queryid),
+        'ts': np.asarray(timestamps, dtype=np.int64),
+        'values': {name: np.asarray(items, dtype=COLUMNS[name]) for name, items in values.items()},
+        'success': True
+    }
+
+def latency_series(queryid, start, end):
+    """Средняя задержка запроса (мс) на интервалах между соседними снимками"""
+    result = series(queryid, start, end)
+    if not result['success']:
+        return result
+
+    calls = result['values']['calls']
+    total_time = result['values']['total_exec_time']
+    delta_calls = np.diff(calls)
+    delta_time = np.diff(total_time)
+    # Интервалы со сбросом статистики и без вызовов пропускаются
+    valid = (delta_calls > 0) & (delta_time >= 0)
+
+    return {
+        'queryid': result['queryid'],
+        'ts': result['ts'][1:][valid],
+        'mean_exec_time': delta_time[valid] / delta_calls[valid],
+        'success': True
+    }
+
+def load_query_texts(queryids):
+    """Тексты запросов по queryid из queries.ndjson"""
+    wanted = {int(queryid) for queryid in queryids}
+    texts = {}
+    if not os.path.exists(QUERIES_FILE):
+        return texts
+    with open(QUERIES_FILE, 'r', encoding='utf-8') as f:
+        for line in f:
+            try:
+                item = json.loads(line)
+            except json.JSONDecodeError:
+                continue
+            if item['queryid'] in wanted:
+                texts[item['queryid']] = item['query']
+    return texts
+
+def import_snapshots(day):
+    """Перенос pg_stat_statements из NDJSON-снимков дня в архив"""
+    return sum(1 for snapshot in load_snapshots(day) if append_snapshot(snapshot))
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Колоночный архив истории pg_stat_statements')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    import_parser = subparsers.add_parser('import', help='импорт NDJSON-снимков в архив')
+    import_parser.add_argument('--day', help='день YYYY-MM-DD (по умолчанию все дни)')
+
+    top_parser = subparsers.add_parser('top', help='топ запросов по приращению метрики')
+    top_parser.add_argument('--metric', default='total_exec_time', choices=sorted(METRICS))
+    top_parser.add_argument('--hours', type=float, default=24, help='интервал до текущего момента')
+    top_parser.add_argument('--limit', type=int, default=20)
+
+    latency_parser = subparsers.add_parser('latency', help='средняя задержка запроса по времени')
+    latency_parser.add_argument('queryid', type=int)
+    latency_parser.add_argument('--days', type=float, default=30)
+
+    args = parser.parse_args()
+    now = datetime.now(timezone.utc)
+
+    if args.command == 'import':
+        for day in [args.day] if args.day else sorted(list_snapshot_days()):
+            print(f"{day}: импортировано снимков {import_snapshots(day)}")
+    elif args.command == 'top':
+        result = top_by_delta(now - timedelta(hours=args.hours), now, args.metric, args.limit)
+        if not result['success']:
+            raise SystemExit(result['error'])
+        texts = load_query_texts(item['queryid'] for item in result['top'])
+        for item in result['top']:
+            print(f"{item['queryid']:>22} {item['delta']:>16.2f}  {texts.get(item['queryid'], '')[:80]}")
+    elif args.command == 'latency':
+        result = latency_series(args.queryid, now - timedelta(days=args.days), now)
+        if not result['success']:
+            raise SystemExit(result['error'])
+        for ts, value in zip(result['ts'], result['mean_exec_time']):
+            print(f"{ms_to_datetime(ts).isoformat()}  {value:.3f} мс")
@@ -0,0 +1,132 @@
+import argparse
+import importlib
+import json
+import math
+import os
+import signal
+import sys
+import threading
+from datetime import datetime
+
+# Сборщики: имя -> (модуль, функция). Модули импортируются при первом использовании,
+# поэтому демон не загружает Flask/Jinja, а numpy — только для vacuum и --archive
+COLLECTORS = {
+    'snapshot': ('snapshots', 'take_snapshot'),
+    'key_metrics': ('collectors', 'get_key_metrics'),
+    'performance': ('collectors', 'get_performance_metrics'),
+    'tables': ('collectors', 'get_table_statistics'),
+    'problematic_queries': ('collectors', 'get_problematic_queries'),
+    'write_path': ('collectors', 'get_write_path_metrics'),
+    'vacuum': ('collectors', 'get_vacuum_metrics'),
+}
+DEFAULT_COLLECTORS = ('snapshot',)
+
+_stop = threading.Event()
+
+def load_collector(name):
+    """Функция сборщика по имени с ленивым импортом модуля"""
+    module_name, function_name = COLLECTORS[name]
+    return getattr(importlib.import_module(module_name), function_name)
+
+def clean_for_json(value):
+    """inf/nan не допустимы в JSON: заменяем на null"""
+    if isinstance(value, float) and not math.isfinite(value):
+        return None
+    if isinstance(value, dict):
+        return {key: clean_for_json(item) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [clean_for_json(item) for item in value]
+    return value
+
+def write_stdout(name, result):
+    record = {'collector': name, 'ts': datetime.now().isoformat(), 'data': clean_for_json(result)}
+    sys.stdout.write(json.dumps(record, ensure_ascii=False, default=str) + '\n')
+    sys.stdout.flush()
+
+def write_local(name, result, archive):
+    """Запись в локальный каталог данных: снимки — в формат отчётов, остальное — в NDJSON по дням
+    (эти файлы веб-интерфейс не читает, они для внешней обработки)"""
+    if name == 'snapshot':
+        from snapshots import save_snapshot
+
+        if not save_snapshot(result):
+            return False
+        if archive:
+            from archive import append_snapshot
+
+            append_snapshot(result)
+        return True
+
+    from snapshots import DATA_DIR
+
+    path = os.path.join(DATA_DIR, 'collector', name)
+    os.makedirs(path, exist_ok=True)
+    record = {'ts': datetime.now().isoformat(), 'data': clean_for_json(result)}
+    with open(os.path.join(path, f"{datetime.now():%Y-%m-%d}.ndjson"), 'a', encoding='utf-8') as f:
+        f.write(json.dumps(record, ensure_ascii=False, default=str) + '\n')
+    return True
+
+def log_error(name, message):
+    print(f"{datetime.now():%Y-%m-%d %H:%M:%S} {name}: {message}", file=sys.stderr)
+
+def run_cycle(connection_string, names, output, archive):
+    """Один проход всех выбранных сборщиков; результаты сразу пишутся и не копятся в памяти"""
+    for name in names:
+        # Ошибка одного сборщика или записи (например, нет места на диске) не останавливает демон
+        try:
+            result = load_collector(name)(connection_string)
+            if not result.get('success'):
+                log_error(name, result.get('error'))
+                continue
+            if output == 'stdout':
+                write_stdout(name, result)
+            elif not write_local(name, result, archive):
+                log_error(name, 'не удалось сохранить результат')
+        except BrokenPipeError:
+            # Получатель стандартного вывода завершился: продолжать бессмысленно
+            raise
+        except Exception as e:
+            log_error(name, e)
+
+def stop(signum, frame):
+    _stop.set()
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Сборщик метрик PostgreSQL без веб-интерфейса')
+    parser.add_argument('--dsn', help='строка подключения (по умолчанию из config.json)')
+    parser.add_argument('--interval', type=float, default=60, help='период сбора, секунд')
+    parser.add_argument('--collect', default=','.join(DEFAULT_COLLECTORS),
+                        help=f"сборщики через запятую: {', '.join(COLLECTORS)}")
+    parser.add_argument('--output', choices=('local', 'stdout'), default='local',
+                        help='local — в каталог данных, stdout — NDJSON в стандартный вывод')
+    parser.add_argument('--data-dir', help='каталог данных (по умолчанию data/ или PG_MONITOR_DATA_DIR)')
+    parser.add_argument('--archive', action='store_true', help='дописывать снимки в колоночный архив')
+    parser.add_argument('--once', action='store_true', help='выполнить один цикл и выйти')
+    args = parser.parse_args()
+
+    names = [name.strip() for name in args.collect.split(',') if name.strip()]
+    unknown = [name for name in names if name not in COLLECTORS]
+    if unknown:
+        parser.error(f"неизвестные сборщики: {', '.join(unknown)}")
+
+    # Каталог данных читается модулями при импорте, поэтому задаём его до первого сбора
+    if args.data_dir:
+        os.environ['PG_MONITOR_DATA_DIR'] = args.data_dir
+
+    connection_string = args.dsn
+    if not connection_string:
+        from snapshots import load_connection_string
+
+        connection_string = load_connection_string()
+    if not connection_string:
+        raise SystemExit("Подключение не настроено: укажите --dsn или заполните config.json")
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+
+    while not _stop.is_set():
+        started = datetime.now()
+        run_cycle(connection_string, names, args.output, args.archive)
+        if args.once:
+            break
+        _stop.wait(max(args.interval - (datetime.now() - started).total_seconds(), 0))
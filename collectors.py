@@ -0,0 +1,525 @@
+import time
+from datetime import datetime
+
+import psycopg2
+
+from snapshots import get_server_major_version
+from write_path import sample_write_path, compute_write_path_rates
+
+# Предыдущий замер пути записи по строке подключения: скорости считаются по разнице
+_write_path_samples = {}
+WRITE_PATH_BOOTSTRAP_SECONDS = 1
+WRITE_PATH_MAX_AGE_SECONDS = 3600
+
+# Состояние прогноза автовакуума по строке подключения (скорости роста dead tuples по таблицам)
+_vacuum_states = {}
+
+# Снимок pg_stat_statements по строке подключения: рейтинги и страницы считаются по нему
+_statement_samples = {}
+STATEMENTS_MAX_AGE_SECONDS = 300
+
+def test_postgres_connection(connection_string):
+    """Тестирование подключения к PostgreSQL"""
+    try:
+        conn = psycopg2.connect(connection_string)
+        conn.close()
+        return True, "Подключение успешно!"
+    except Exception as e:
+        return False, f"Ошибка подключения: {str(e)}"
+
+def check_pg_stat_statements(connection_string):
+    """Проверка наличия расширения pg_stat_statements"""
+    try:
+        conn = psycopg2.connect(connection_string)
+        cursor = conn.cursor()
+        
+        cursor.execute("SELECT * FROM pg_extension WHERE extname = 'pg_stat_statements';")
+        result = cursor.fetchone()
+        
+        cursor.close()
+        conn.close()
+        
+        return result is not None
+    except Exception as e:
+        print(f"Ошибка при проверке расширения pg_stat_statements: {e}")
+        return False
+
+def get_databases_list(connection_string):
+    """Получение списка всех баз данных"""
+    try:
+        base_conn_string = connection_string.replace("dbname='postgres'", "dbname='postgres'")
+        conn = psycopg2.connect(base_conn_string)
+        cursor = conn.cursor()
+        
+        cursor.execute("""
+            SELECT datname 
+            FROM pg_database 
+            WHERE datistemplate = false 
+            AND datname NOT LIKE 'template%'
+            ORDER BY datname;
+        """)
+        
+        databases = [row[0] for row in cursor.fetchall()]
+        cursor.close()
+        conn.close()
+        
+        return databases
+    except Exception as e:
+        print(f"Ошибка при получении списка БД: {e}")
+        return []
+
+def get_postgres_info(connection_string):
+    """Получение информации о PostgreSQL"""
+    try:
+        conn = psycopg2.connect(connection_string)
+        cursor = conn.cursor()
+        
+        cursor.execute("SELECT version();")
+        version = cursor.fetchone()[0]
+        
+        cursor.execute("SELECT pg_postmaster_start_time();")
+        start_time = cursor.fetchone()[0]
+        
+        cursor.execute("SELECT pg_current_wal_lsn();")
+        wal_lsn = cursor.fetchone()[0]
+        
+        # Проверяем наличие расширения
+        has_pg_stat_statements = check_pg_stat_statements(connection_string)
+        
+        cursor.close()
+        conn.close()
+        
+        return {
+            'version': version,
+            'start_time': start_time.strftime('%Y-%m-%d %H:%M:%S'),
+            'wal_lsn': wal_lsn,
+            'has_pg_stat_statements': has_pg_stat_statements,
+            'success': True
+        }
+    except Exception as e:
+        return {
+            'success': False,
+            'error': str(e)
+        }
+
+def get_key_metrics(connection_string):
+    """Получение ключевых метрик базы данных"""
+    try:
+        conn = psycopg2.connect(connection_string)
+        cursor = conn.cursor()
+        
+        query = """
+        SELECT 
+            datname,
+            numbackends as connections,
+            xact_commit as commits,
+            xact_rollback as rollbacks,
+            blks_read as disk_reads,
+            blks_hit as cache_hits,
+            tup_returned as rows_returned,
+            tup_fetched as rows_fetched,
+            tup_inserted as rows_inserted,
+            tup_updated as rows_updated,
+            tup_deleted as rows_deleted
+        FROM pg_stat_database 
+        WHERE datname = current_database();
+        """
+        
+        cursor.execute(query)
+        columns = [desc[0] for desc in cursor.description]
+        result = cursor.fetchone()
+        
+        cursor.close()
+        conn.close()
+        
+        if result:
+            metrics = dict(zip(columns, result))
+            
+            total_reads = metrics['disk_reads'] + metrics['cache_hits']
+            if total_reads > 0:
+                metrics['cache_hit_ratio'] = round((metrics['cache_hits'] / total_reads) * 100, 2)
+            else:
+                metrics['cache_hit_ratio'] = 0
+                
+            total_transactions = metrics['commits'] + metrics['rollbacks']
+            if total_transactions > 0:
+                metrics['rollback_ratio'] = round((metrics['rollbacks'] / total_transactions) * 100, 2)
+            else:
+                metrics['rollback_ratio'] = 0
+                
+            metrics['success'] = True
+            return metrics
+        else:
+            return {'success': False, 'error': 'No data found'}
+            
+    except Exception as e:
+        return {
+            'success': False,
+            'error': str(e)
+        }
+
+def get_table_statistics(connection_string):
+    """Получение статистики по таблицам"""
+    try:
+        conn = psycopg2.connect(connection_string)
+        cursor = conn.cursor()
+        
+        query = """
+        SELECT 
+            schemaname,
+            relname as table_name,
+            COALESCE(NULLIF(seq_scan::text, '')::bigint, 0) as sequential_scans,
+            COALESCE(NULLIF(seq_tup_read::text, '')::bigint, 0) as seq_rows_read,
+            COALESCE(NULLIF(idx_scan::text, '')::bigint, 0) as index_scans,
+            COALESCE(NULLIF(idx_tup_fetch::text, '')::bigint, 0) as index_rows_fetched,
+            COALESCE(NULLIF(n_tup_ins::text, '')::bigint, 0) as inserts,
+            COALESCE(NULLIF(n_tup_upd::text, '')::bigint, 0) as updates,
+            COALESCE(NULLIF(n_tup_del::text, '')::bigint, 0) as deletes,
+            COALESCE(NULLIF(n_tup_hot_upd::text, '')::bigint, 0) as hot_updates,
+            COALESCE(NULLIF(n_live_tup::text, '')::bigint, 0) as live_rows,
+            COALESCE(NULLIF(n_dead_tup::text, '')::bigint, 0) as dead_rows
+        FROM pg_stat_all_tables
+        WHERE schemaname NOT LIKE 'pg_%' 
+        ORDER BY COALESCE(NULLIF(n_dead_tup::text, '')::bigint, 0) DESC;
+        """
+        
+        cursor.execute(query)
+        columns = [desc[0] for desc in cursor.description]
+        results = cursor.fetchall()
+        
+        cursor.close()
+        conn.close()
+        
+        if results:
+            tables = []
+            for row in results:
+                table_data = dict(zip(columns, row))
+                
+                sequential_scans = table_data['sequential_scans']
+                index_scans = table_data['index_scans']
+                total_scans = sequential_scans + index_scans
+                
+                if total_scans > 0:
+                    table_data['index_scan_ratio'] = round((index_scans / total_scans) * 100, 2)
+                else:
+                    table_data['index_scan_ratio'] = 0
+                    
+                live_rows = table_data['live_rows']
+                dead_rows = table_data['dead_rows']
+                total_rows = live_rows + dead_rows
+                
+                if total_rows > 0:
+                    table_data['dead_row_ratio'] = round((dead_rows / total_rows) * 100, 2)
+                else:
+                    table_data['dead_row_ratio'] = 0
+                    
+                tables.append(table_data)
+            
+            return {
+                'tables': tables,
+                'total_tables': len(tables),
+                'success': True
+            }
+        else:
+            return {'success': False, 'error': 'No table statistics found'}
+            
+    except Exception as e:
+        return {
+            'success': False,
+            'error': str(e)
+        }
+
+def get_full_detailed_metrics(connection_string):
+    """Получение полной детальной статистики"""
+    try:
+        conn = psycopg2.connect(connection_string)
+        cursor = conn.cursor()
+        
+        # Комплексный запрос с множеством метрик
+        query = """
+        SELECT 
+            -- Базовая информация
+            current_database() as database_name,
+            current_user as current_user,
+            inet_server_addr() as server_address,
+            inet_server_port() as server_port,
+            
+            -- Статистика базы данных
+            (SELECT count(*) FROM pg_stat_activity) as total_connections,
+            (SELECT count(*) FROM pg_stat_activity WHERE state = 'active') as active_connections,
+            (SELECT count(*) FROM pg_stat_activity WHERE state = 'idle') as idle_connections,
+            
+            -- Размер базы данных
+            pg_database_size(current_database()) as database_size_bytes,
+            
+            -- Статистика транзакций
+            xact_commit as total_commits,
+            xact_rollback as total_rollbacks,
+            
+            -- Статистика ввода/вывода
+            blks_read as blocks_read,
+            blks_hit as blocks_hit,
+            
+            -- Статистика запросов
+            tup_returned as tuples_returned,
+            tup_fetched as tuples_fetched,
+            tup_inserted as tuples_inserted,
+            tup_updated as tuples_updated,
+            tup_deleted as tuples_deleted,
+            
+            -- Время работы
+            (SELECT extract(epoch from now() - pg_postmaster_start_time())) as uptime_seconds,
+            
+            -- Настройки
+            (SELECT setting FROM pg_settings WHERE name = 'shared_buffers') as shared_buffers,
+            (SELECT setting FROM pg_settings WHERE name = 'work_mem') as work_mem,
+            (SELECT setting FROM pg_settings WHERE name = 'maintenance_work_mem') as maintenance_work_mem
+            
+        FROM pg_stat_database 
+        WHERE datname = current_database();
+        """
+        
+        cursor.execute(query)
+        columns = [desc[0] for desc in cursor.description]
+        result = cursor.fetchone()
+        
+        cursor.close()
+        conn.close()
+        
+        if result:
+            metrics = dict(zip(columns, result))
+            
+            # Рассчитываем дополнительные метрики
+            if metrics['blocks_read'] + metrics['blocks_hit'] > 0:
+                metrics['cache_hit_ratio'] = round((metrics['blocks_hit'] / (metrics['blocks_read'] + metrics['blocks_hit'])) * 100, 2)
+            else:
+                metrics['cache_hit_ratio'] = 0
+                
+            if metrics['total_commits'] + metrics['total_rollbacks'] > 0:
+                metrics['rollback_ratio'] = round((metrics['total_rollbacks'] / (metrics['total_commits'] + metrics['total_rollbacks'])) * 100, 2)
+            else:
+                metrics['rollback_ratio'] = 0
+                
+            # Форматируем размер базы данных
+            metrics['database_size_mb'] = round(metrics['database_size_bytes'] / (1024 * 1024), 2)
+            metrics['database_size_gb'] = round(metrics['database_size_bytes'] / (1024 * 1024 * 1024), 2)
+            
+            metrics['success'] = True
+            return metrics
+        else:
+            return {'success': False, 'error': 'No detailed metrics found'}
+            
+    except Exception as e:
+        return {
+            'success': False,
+            'error': str(e)
+        }
+
+def get_problematic_queries(connection_string, ranking='total_time', dbid=None, userid=None, pattern=None,
+                            page=1, per_page=50, refresh=True):
+    """Поиск проблемных запросов через pg_stat_statements: рейтинг по снимку всего набора запросов"""
+    try:
+        # numpy нужен только этому сборщику и автовакууму
+        from statements import sample_statements, rank_statements
+
+        cached = _statement_samples.get(connection_string)
+        if refresh or cached is None or time.time() - cached['taken_at'] > STATEMENTS_MAX_AGE_SECONDS:
+            # Проверяем наличие расширения
+            if not check_pg_stat_statements(connection_string):
+                return {'success': False, 'error': 'Расширение pg_stat_statements не установлено'}
+
+            conn = psycopg2.connect(connection_string)
+            cursor = conn.cursor()
+            cached = sample_statements(cursor)
+
+            cursor.close()
+            conn.close()
+
+            _statement_samples[connection_string] = cached
+
+        if not cached['count']:
+            return {'success': False, 'error': 'No query statistics found'}
+
+        # Смена рейтинга, фильтров и страницы считается по снимку без обращения к серверу
+        result = rank_statements(cached, ranking, dbid, userid, pattern, page, per_page)
+        result.update({
+            'databases': cached['databases'],
+            'users': cached['users'],
+            'taken_at': datetime.fromtimestamp(cached['taken_at']),
+            'success': True
+        })
+        return result
+
+    except Exception as e:
+        return {
+            'success': False,
+            'error': str(e)
+        }
+
+def get_performance_metrics(connection_string):
+    """Мониторинг производительности"""
+    try:
+        conn = psycopg2.connect(connection_string)
+        cursor = conn.cursor()
+        
+        # Комплексные метрики производительности
+        query = """
+        WITH db_stats AS (
+            SELECT 
+                datname,
+                xact_commit,
+                xact_rollback,
+                blks_read,
+                blks_hit,
+                tup_returned,
+                tup_fetched,
+                tup_inserted,
+                tup_updated,
+                tup_deleted
+            FROM pg_stat_database 
+            WHERE datname = current_database()
+        ),
+        table_stats AS (
+            SELECT 
+                count(*) as total_tables,
+                sum(n_live_tup) as total_live_rows,
+                sum(n_dead_tup) as total_dead_rows,
+                sum(seq_scan) as total_seq_scans,
+                sum(idx_scan) as total_idx_scans
+            FROM pg_stat_all_tables 
+            WHERE schemaname NOT LIKE 'pg_%'
+        ),
+        index_stats AS (
+            SELECT 
+                count(*) as total_indexes,
+                sum(idx_scan) as total_index_scans
+            FROM pg_stat_all_indexes
+        ),
+        connection_stats AS (
+            SELECT 
+                count(*) as total_connections,
+                count(*) FILTER (WHERE state = 'active') as active_connections
+            FROM pg_stat_activity
+            WHERE datname = current_database()
+        )
+        SELECT 
+            -- Статистика БД
+            d.xact_commit as commits,
+            d.xact_rollback as rollbacks,
+            d.blks_read as disk_reads,
+            d.blks_hit as cache_hits,
+            
+            -- Статистика таблиц
+            t.total_tables,
+            t.total_live_rows,
+            t.total_dead_rows,
+            t.total_seq_scans,
+            t.total_idx_scans,
+            
+            -- Статистика индексов
+            i.total_indexes,
+            i.total_index_scans,
+            
+            -- Статистика подключений
+            c.total_connections,
+            c.active_connections,
+            
+            -- Расчетные метрики
+            CASE 
+                WHEN (d.blks_read + d.blks_hit) > 0 THEN 
+                    round(100.0 * d.blks_hit / (d.blks_read + d.blks_hit), 2)
+                ELSE 0 
+            END as cache_hit_ratio,
+            
+            CASE 
+                WHEN (t.total_seq_scans + t.total_idx_scans) > 0 THEN 
+                    round(100.0 * t.total_idx_scans / (t.total_seq_scans + t.total_idx_scans), 2)
+                ELSE 0 
+            END as index_usage_ratio,
+            
+            CASE 
+                WHEN (t.total_live_rows + t.total_dead_rows) > 0 THEN 
+                    round(100.0 * t.total_dead_rows / (t.total_live_rows + t.total_dead_rows), 2)
+                ELSE 0 
+            END as dead_rows_ratio
+            
+        FROM db_stats d, table_stats t, index_stats i, connection_stats c;
+        """
+        
+        cursor.execute(query)
+        columns = [desc[0] for desc in cursor.description]
+        result = cursor.fetchone()
+        
+        cursor.close()
+        conn.close()
+        
+        if result:
+            metrics = dict(zip(columns, result))
+            metrics['success'] = True
+            return metrics
+        else:
+            return {'success': False, 'error': 'No performance metrics found'}
+            
+    except Exception as e:
+        return {
+            'success': False,
+            'error': str(e)
+        }
+
+def get_write_path_metrics(connection_string):
+    """WAL, контрольные точки и репликация: скорости по разнице с предыдущим замером"""
+    try:
+        conn = psycopg2.connect(connection_string)
+        cursor = conn.cursor()
+        major_version = get_server_major_version(cursor)
+
+        previous = _write_path_samples.get(connection_string)
+        if previous is None or time.time() - previous['taken_at'] > WRITE_PATH_MAX_AGE_SECONDS:
+            # Первый замер: короткая пауза, чтобы сразу получить скорости
+            previous = {'taken_at': time.time(), 'sample': sample_write_path(cursor, major_version)}
+            conn.rollback()
+            time.sleep(WRITE_PATH_BOOTSTRAP_SECONDS)
+
+        current = sample_write_path(cursor, major_version)
+
+        cursor.close()
+        conn.close()
+
+        _write_path_samples[connection_string] = {'taken_at': time.time(), 'sample': current}
+
+        return {
+            'sample': current,
+            'rates': compute_write_path_rates(previous['sample'], current),
+            'success': True
+        }
+    except Exception as e:
+        return {
+            'success': False,
+            'error': str(e)
+        }
+
+def get_vacuum_metrics(connection_string):
+    """Автовакуум: прогресс, прогноз достижения порога и близость wraparound по таблицам"""
+    try:
+        conn = psycopg2.connect(connection_string)
+        cursor = conn.cursor()
+
+        # numpy нужен только этому сборщику: не загружаем его при импорте модуля
+        from vacuum import sample_vacuum, new_vacuum_state, update_vacuum_state, forecast_vacuum
+
+        sample = sample_vacuum(cursor)
+
+        cursor.close()
+        conn.close()
+
+        state = _vacuum_states.setdefault(connection_string, new_vacuum_state())
+        update_vacuum_state(state, sample)
+
+        metrics = forecast_vacuum(state, sample)
+        metrics['success'] = True
+        return metrics
+    except Exception as e:
+        return {
+            'success': False,
+            'error': str(e)
+        }
@@ -0,0 +1,379 @@
+import argparse
+import hashlib
+import heapq
+import json
+import os
+import re
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta
+
+import psycopg2
+
+from snapshots import DATA_DIR, get_server_major_version, load_connection_string
+
+PLANS_DIR = os.path.join(DATA_DIR, 'plans')
+INDEX_FILE = os.path.join(PLANS_DIR, 'index.json')
+
+MAX_PLANS = 500
+TOP_N = 10
+STATEMENT_TIMEOUT = '2s'
+LOCK_TIMEOUT = '100ms'
+CONNECT_TIMEOUT = 5
+
+# EXPLAIN применим только к планируемым запросам, служебные команды пропускаем
+EXPLAINABLE = re.compile(r'^\s*(select|with|insert|update|delete|merge|values|table)\b', re.IGNORECASE)
+PARAMETER = re.compile(r'\$(\d+)')
+JSON_STRING = re.compile(r'"(?:[^"\\]|\\.)*"')
+# Предел размера одного плана в журнале: защита от незакрытого JSON
+MAX_PLAN_SIZE = 16 * 1024 * 1024
+
+# Поля узла, определяющие форму плана. Условия с литералами, стоимости, фактические
+# значения и параметры выполнения (Sort Method, Workers, I/O) в хэш не входят:
+# иначе каждый замер auto_explain выглядел бы как новый план
+STRUCTURAL_KEYS = (
+    'Node Type', 'Join Type', 'Strategy', 'Relation Name', 'Index Name', 'Parent Relationship',
+)
+# Сколько дней после смены плана показывать отметку «изменился»
+CHANGE_MARK_DAYS = 7
+# Сколько дней хранить ошибку EXPLAIN для запроса без сохранённых планов
+ERROR_KEEP_DAYS = 7
+
+# Кэш индекса планов для страниц: (mtime, индекс)
+_index_cache = None
+
+def plan_shape(node):
+    """Форма плана: только структурные поля узлов и дочерние узлы"""
+    shape = {key: node[key] for key in STRUCTURAL_KEYS if key in node}
+    if node.get('Plans'):
+        shape['Plans'] = [plan_shape(child) for child in node['Plans']]
+    return shape
+
+def plan_hash(plan):
+    """Хэш формы плана: одинаков для планов, отличающихся только литералами, оценками и замерами"""
+    shape = json.dumps(plan_shape(plan), sort_keys=True, ensure_ascii=False)
+    return hashlib.sha1(shape.encode('utf-8')).hexdigest()[:16]
+
+def recently_changed(statement):
+    """Сменился ли план запроса за последние CHANGE_MARK_DAYS дней"""
+    changed_at = (statement or {}).get('changed_at')
+    if not changed_at:
+        return False
+    return datetime.now() - datetime.strptime(changed_at, '%Y-%m-%d %H:%M:%S') < timedelta(days=CHANGE_MARK_DAYS)
+
+def plan_to_text(plan, level=0):
+    """Текстовое представление JSON-плана в стиле EXPLAIN"""
+    lines = []
+    title = plan.get('Node Type', '?')
+    if plan.get('Join Type'):
+        title = f"{plan['Join Type']} {title}"
+    if plan.get('Index Name'):
+        title += f" using {plan['Index Name']}"
+    if plan.get('Relation Name'):
+        title += f" on {plan['Relation Name']}"
+        if plan.get('Alias') and plan['Alias'] != plan['Relation Name']:
+            title += f" {plan['Alias']}"
+    if 'Total Cost' in plan:
+        title += f"  (cost={plan.get('Startup Cost', 0):.2f}..{plan['Total Cost']:.2f} rows={plan.get('Plan Rows', 0)} width={plan.get('Plan Width', 0)})"
+
+    indent = '      ' * level
+    lines.append(f"{indent}{'->  ' if level else ''}{title}")
+    for key in ('Index Cond', 'Recheck Cond', 'Hash Cond', 'Merge Cond', 'Join Filter', 'Filter', 'Sort Key', 'Group Key'):
+        if key in plan:
+            value = ', '.join(plan[key]) if isinstance(plan[key], list) else plan[key]
+            lines.append(f"{indent}      {key}: {value}")
+    for child in plan.get('Plans', []):
+        lines.extend(plan_to_text(child, level + 1))
+    return lines if level else '\n'.join(lines)
+
+def fetch_top_statements(cursor, previous, limit):
+    """Топ запросов текущей базы по приросту total_exec_time с прошлого цикла"""
+    cursor.execute("""
+        SELECT queryid, sum(total_exec_time)
+        FROM pg_stat_statements
+        WHERE dbid = (SELECT oid FROM pg_database WHERE datname = current_database())
+          AND queryid IS NOT NULL
+        GROUP BY queryid;
+    """)
+    current = {queryid: total for queryid, total in cursor.fetchall()}
+
+    deltas = []
+    for queryid, total in current.items():
+        before = previous.get(queryid, 0)
+        deltas.append((total - before if total >= before else total, queryid))
+    # Частичный отбор вместо полной сортировки
+    top = [queryid for delta, queryid in heapq.nlargest(limit, deltas) if delta > 0]
+    return top, current
+
+def fetch_query_text(cursor, queryid):
+    cursor.execute("""
+        SELECT query
+        FROM pg_stat_statements
+        WHERE queryid = %s
+          AND dbid = (SELECT oid FROM pg_database WHERE datname = current_database())
+        LIMIT 1;
+    """, (queryid,))
+    row = cursor.fetchone()
+    return row[0] if row else None
+
+def explain_generic(conn, query, major_version):
+    """Безопасный EXPLAIN без выполнения: generic-план, read only, жёсткие таймауты"""
+    cursor = conn.cursor()
+    try:
+        cursor.execute(f"SET LOCAL statement_timeout = '{STATEMENT_TIMEOUT}';")
+        cursor.execute(f"SET LOCAL lock_timeout = '{LOCK_TIMEOUT}';")
+
+        parameters = max((int(number) for number in PARAMETER.findall(query)), default=0)
+        if major_version >= 16:
+            options = 'FORMAT JSON, GENERIC_PLAN' if parameters else 'FORMAT JSON'
+            cursor.execute(f"EXPLAIN ({options}) {query}")
+        elif parameters:
+            # До 16 версии: generic-план подготовленного запроса с NULL вместо параметров
+            cursor.execute("SET LOCAL plan_cache_mode = force_generic_plan;")
+            cursor.execute(f"PREPARE pg_daily_monitoring_plan AS {query}")
+            try:
+                nulls = ', '.join(['NULL'] * parameters)
+                cursor.execute(f"EXPLAIN (FORMAT JSON) EXECUTE pg_daily_monitoring_plan({nulls})")
+            finally:
+                cursor.execute("DEALLOCATE pg_daily_monitoring_plan;")
+        else:
+            cursor.execute(f"EXPLAIN (FORMAT JSON) {query}")
+
+        result = cursor.fetchone()[0]
+        if isinstance(result, str):
+            result = json.loads(result)
+        return result[0]['Plan']
+    finally:
+        cursor.close()
+        conn.rollback()
+
+def load_plan_index():
+    """Индекс сохранённых планов: порядок последнего захвата и история по queryid"""
+    if not os.path.exists(INDEX_FILE):
+        return {'captured': [], 'statements': {}}
+    try:
+        with open(INDEX_FILE, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, json.JSONDecodeError) as e:
+        print(f"Ошибка загрузки индекса планов: {e}")
+        return {'captured': [], 'statements': {}}
+
+def get_plan_index():
+    """Индекс планов для страниц UI (кэшируется до изменения файла)"""
+    global _index_cache
+    try:
+        mtime = os.path.getmtime(INDEX_FILE)
+    except OSError:
+        return {'captured': [], 'statements': {}}
+    if _index_cache is None or _index_cache[0] != mtime:
+        _index_cache = (mtime, load_plan_index())
+    return _index_cache[1]
+
+def save_plan_index(index):
+    os.makedirs(PLANS_DIR, exist_ok=True)
+    tmp_path = INDEX_FILE + '.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(index, f, ensure_ascii=False)
+    os.replace(tmp_path, INDEX_FILE)
+
+def plan_path(queryid, hash_value):
+    return os.path.join(PLANS_DIR, f"{queryid}_{hash_value}.json")
+
+def load_plan(queryid, hash_value):
+    """Сохранённый план; к серверу не обращается"""
+    if not re.fullmatch(r'[0-9a-f]{16}', hash_value or ''):
+        return None
+    try:
+        with open(plan_path(int(queryid), hash_value), 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+def store_plan(index, queryid, query, plan, source):
+    """Сохранение плана в кэш (по паре queryid, хэш) и отметка о смене плана"""
+    hash_value = plan_hash(plan)
+    captured_at = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+    key = [queryid, hash_value]
+
+    os.makedirs(PLANS_DIR, exist_ok=True)
+    with open(plan_path(queryid, hash_value), 'w', encoding='utf-8') as f:
+        json.dump({
+            'queryid': queryid,
+            'plan_hash': hash_value,
+            'query': query,
+            'plan': plan,
+            'plan_text': plan_to_text(plan),
+            'captured_at': captured_at,
+            'source': source,
+        }, f, ensure_ascii=False)
+
+    # Вытесняются планы, дольше всех не встречавшиеся при захвате (просмотр порядок не меняет)
+    captured = OrderedDict((tuple(item), None) for item in index['captured'])
+    captured.pop(tuple(key), None)
+    captured[tuple(key)] = None
+    while len(captured) > MAX_PLANS:
+        old_queryid, old_hash = captured.popitem(last=False)[0]
+        try:
+            os.remove(plan_path(old_queryid, old_hash))
+        except OSError:
+            pass
+        forget_plan(index, old_queryid, old_hash)
+    index['captured'] = [list(item) for item in captured]
+
+    statement = index['statements'].setdefault(str(queryid), {'history': []})
+    statement['query'] = query
+    statement['last_captured_at'] = captured_at
+    statement.pop('error', None)
+    statement.pop('error_at', None)
+    history = statement['history']
+    if history and history[-1]['plan_hash'] == hash_value:
+        history[-1]['last_seen'] = captured_at
+        # План стабилен дольше срока отметки: снимаем её
+        if not recently_changed(statement):
+            statement.pop('changed_at', None)
+    else:
+        if history:
+            statement['changed_at'] = captured_at
+            statement['previous_hash'] = history[-1]['plan_hash']
+        history.append({'plan_hash': hash_value, 'first_seen': captured_at, 'last_seen': captured_at, 'source': source})
+        del history[:-20]
+    statement['plan_hash'] = hash_value
+    return hash_value
+
+def forget_plan(index, queryid, hash_value):
+    """Удаление из индекса ссылок на вытесненный план"""
+    statement = index['statements'].get(str(queryid))
+    if statement is None:
+        return
+    statement['history'] = [item for item in statement['history'] if item['plan_hash'] != hash_value]
+    if statement.get('previous_hash') == hash_value:
+        statement.pop('previous_hash')
+        statement.pop('changed_at', None)
+    if statement.get('plan_hash') == hash_value:
+        if statement['history']:
+            # Показываем последний из оставшихся в кэше планов
+            statement['plan_hash'] = statement['history'][-1]['plan_hash']
+        else:
+            del index['statements'][str(queryid)]
+
+def prune_statements(index):
+    """Удаление записей о запросах без сохранённых планов, ошибка которых устарела"""
+    limit = (datetime.now() - timedelta(days=ERROR_KEEP_DAYS)).strftime('%Y-%m-%d %H:%M:%S')
+    for queryid, statement in list(index['statements'].items()):
+        if not statement.get('plan_hash') and statement.get('error_at', '') < limit:
+            del index['statements'][queryid]
+
+def capture_plans(connection_string, previous=None, limit=TOP_N):
+    """Один цикл сборщика: EXPLAIN для топ-N запросов по приросту времени"""
+    previous = previous or {}
+    try:
+        conn = psycopg2.connect(connection_string, connect_timeout=CONNECT_TIMEOUT)
+        conn.set_session(readonly=True)
+        cursor = conn.cursor()
+        major_version = get_server_major_version(cursor)
+        top, current = fetch_top_statements(cursor, previous, limit)
+        texts = {queryid: fetch_query_text(cursor, queryid) for queryid in top}
+        cursor.close()
+        conn.rollback()
+
+        index = load_plan_index()
+        captured = 0
+        for queryid in top:
+            query = texts.get(queryid)
+            if not query or not EXPLAINABLE.match(query):
+                continue
+            try:
+                plan = explain_generic(conn, query, major_version)
+            except Exception as e:
+                conn.rollback()
+                statement = index['statements'].setdefault(str(queryid), {'history': []})
+                statement['error'] = str(e).strip()
+                statement['error_at'] = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+                continue
+            store_plan(index, queryid, query, plan, 'explain')
+            captured += 1
+
+        conn.close()
+        prune_statements(index)
+        save_plan_index(index)
+        return {'captured': captured, 'candidates': len(top), 'counters': current, 'success': True}
+    except Exception as e:
+        return {'success': False, 'error': str(e), 'counters': previous}
+
+def read_auto_explain_plans(f):
+    """JSON-планы из журнала по строкам, без чтения файла целиком"""
+    decoder = json.JSONDecoder()
+    parts = None
+    depth = 0
+    waiting = False
+    for line in f:
+        if parts is None:
+            if not waiting:
+                position = line.find('plan:')
+                if position == -1:
+                    continue
+                line = line[position + len('plan:'):]
+                waiting = True
+            # JSON плана начинается на той же или на следующей строке после «plan:»
+            start = line.find('{')
+            if start == -1:
+                continue
+            line = line[start:]
+            parts, depth, size, waiting = [], 0, 0, False
+
+        parts.append(line)
+        size += len(line)
+        # Строки JSON не переносятся, поэтому скобки внутри строк отбрасываем построчно
+        bare = JSON_STRING.sub('', line)
+        depth += bare.count('{') - bare.count('}')
+        if depth <= 0 or size > MAX_PLAN_SIZE:
+            text, parts = ''.join(parts), None
+            try:
+                yield decoder.raw_decode(text)[0]
+            except json.JSONDecodeError:
+                continue
+
+def import_auto_explain_log(path):
+    """Импорт планов из журнала auto_explain (auto_explain.log_format = json, log_verbose = on)"""
+    index = load_plan_index()
+    imported = 0
+    with open(path, 'r', encoding='utf-8', errors='replace') as f:
+        for entry in read_auto_explain_plans(f):
+            # queryid попадает в план только при compute_query_id и log_verbose
+            queryid = entry.get('Query Identifier')
+            if queryid is None or 'Plan' not in entry:
+                continue
+            store_plan(index, int(queryid), entry.get('Query Text', ''), entry['Plan'], 'auto_explain')
+            imported += 1
+
+    prune_statements(index)
+    save_plan_index(index)
+    return imported
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Сборщик планов для топ-запросов pg_stat_statements')
+    parser.add_argument('--interval', type=int, default=600, help='период между циклами, секунд')
+    parser.add_argument('--top', type=int, default=TOP_N, help='сколько запросов объяснять за цикл')
+    parser.add_argument('--once', action='store_true', help='выполнить один цикл и выйти')
+    parser.add_argument('--auto-explain-log', help='импортировать планы из журнала auto_explain и выйти')
+    args = parser.parse_args()
+
+    if args.auto_explain_log:
+        print(f"Импортировано планов: {import_auto_explain_log(args.auto_explain_log)}")
+        raise SystemExit(0)
+
+    connection_string = load_connection_string()
+    if not connection_string:
+        raise SystemExit("Подключение не настроено: заполните config.json через страницу Подключение к Postgres")
+
+    counters = {}
+    while True:
+        result = capture_plans(connection_string, counters, args.top)
+        counters = result['counters']
+        if result['success']:
+            print(f"{datetime.now():%Y-%m-%d %H:%M:%S} планов: {result['captured']} из {result['candidates']}")
+        else:
+            print(f"{datetime.now():%Y-%m-%d %H:%M:%S} ошибка сборщика планов: {result['error']}")
+        if args.once:
+            break
+        time.sleep(args.interval)
@@ -0,0 +1,391 @@
+import argparse
+import json
+import os
+from datetime import date, datetime, timedelta
+
+from snapshots import BASE_DIR, DATA_DIR, load_snapshots, list_snapshot_days
+from write_path import compute_write_path_rates, share
+
+REPORTS_DIR = os.path.join(DATA_DIR, 'reports')
+TEMPLATES_DIR = os.path.join(BASE_DIR, 'templates')
+TOP_N = 20
+
+# Колонки pg_stat_statements, по которым считаются приращения за день
+STATEMENT_COUNTERS = (
+    'calls', 'total_exec_time', 'rows',
+    'shared_blks_hit', 'shared_blks_read', 'shared_blks_written',
+    'local_blks_read', 'local_blks_written',
+    'temp_blks_read', 'temp_blks_written',
+)
+
+# Секции отчёта, которые дополнительно сохраняются в Parquet
+PARQUET_SECTIONS = ('top_statements_by_time', 'top_statements_by_io', 'dead_tuple_growth', 'unused_indexes')
+
+# Кэш загруженных отчётов: день -> (mtime файла, отчёт)
+_report_cache = {}
+
+def counter_delta(last, first):
+    """Приращение счётчика с учётом сброса статистики между снимками"""
+    if last is None:
+        return 0
+    if first is None or last < first:
+        return last
+    return last - first
+
+def parse_ts(value):
+    return datetime.fromisoformat(value)
+
+def statement_counters(snapshot, queries=None):
+    """Счётчики pg_stat_statements снимка, суммированные по queryid"""
+    per_query = {}
+    for row in snapshot.get('statements', []):
+        queryid = row.get('queryid')
+        if queryid is None:
+            continue
+        # Один queryid может встречаться для нескольких пользователей/баз
+        counters = per_query.setdefault(queryid, dict.fromkeys(STATEMENT_COUNTERS, 0))
+        for name in STATEMENT_COUNTERS:
+            counters[name] += row.get(name) or 0
+        if queries is not None and row.get('query'):
+            queries[queryid] = row['query']
+    return per_query
+
+def aggregate_statements(snapshots, baseline=None):
+    """Топ запросов по приращению времени выполнения и ввода-вывода (сумма приростов между снимками)"""
+    queries = {}
+    totals = {}
+    # Последний снимок прошлого дня: работа до первого снимка дня тоже попадает в отчёт
+    previous = statement_counters(baseline) if baseline else None
+
+    for snapshot in snapshots:
+        current = statement_counters(snapshot, queries)
+        if previous is not None:
+            for queryid, counters in current.items():
+                # Запрос, появившийся между снимками, считается с нуля; сброс статистики — с момента сброса
+                before = previous.get(queryid, {})
+                total = totals.setdefault(queryid, dict.fromkeys(STATEMENT_COUNTERS, 0))
+                for name in STATEMENT_COUNTERS:
+                    total[name] += counter_delta(counters[name], before.get(name, 0))
+        previous = current
+
+    statements = []
+    for queryid, row in totals.items():
+        row['io_blocks'] = (row['shared_blks_read'] + row['shared_blks_written']
+                            + row['local_blks_read'] + row['local_blks_written']
+                            + row['temp_blks_read'] + row['temp_blks_written'])
+        if row['calls'] == 0 and row['total_exec_time'] == 0:
+            continue
+        row['mean_exec_time'] = round(row['total_exec_time'] / row['calls'], 3) if row['calls'] else 0
+        row['total_exec_time'] = round(row['total_exec_time'], 3)
+        row['queryid'] = queryid
+        query = queries.get(queryid, '')
+        row['short_query'] = query[:100] + '...' if len(query) > 100 else query
+        statements.append(row)
+
+    by_time = sorted(statements, key=lambda x: x['total_exec_time'], reverse=True)[:TOP_N]
+    by_io = sorted(statements, key=lambda x: x['io_blocks'], reverse=True)[:TOP_N]
+    return by_time, by_io
+
+def aggregate_tables(snapshots):
+    """Таблицы с самым быстрым ростом dead tuples (сумма приростов между снимками)"""
+    growth = {}
+    previous = {}
+    first_ts = {}
+    last_ts = {}
+    last_rows = {}
+
+    for snapshot in snapshots:
+        ts = parse_ts(snapshot['ts'])
+        for row in snapshot.get('tables', []):
+            key = f"{row['schemaname']}.{row['table_name']}"
+            dead_rows = row.get('dead_rows') or 0
+            if key in previous:
+                # Падение означает, что прошёл vacuum, прирост с нуля не учитываем
+                growth[key] += max(dead_rows - previous[key], 0)
+            else:
+                growth[key] = 0
+                first_ts[key] = ts
+            previous[key] = dead_rows
+            last_ts[key] = ts
+            last_rows[key] = row
+
+    tables = []
+    for key, dead_growth in growth.items():
+        hours = (last_ts[key] - first_ts[key]).total_seconds() / 3600
+        if dead_growth == 0 or hours <= 0:
+            continue
+        row = last_rows[key]
+        tables.append({
+            'table': key,
+            'dead_rows_growth': dead_growth,
+            'dead_rows_per_hour': round(dead_growth / hours, 2),
+            'dead_rows': row.get('dead_rows') or 0,
+            'live_rows': row.get('live_rows') or 0,
+        })
+
+    return sorted(tables, key=lambda x: x['dead_rows_per_hour'], reverse=True)[:TOP_N]
+
+def aggregate_unused_indexes(snapshots):
+    """Индексы без сканирований по последнему снимку дня (sql/indexes.sql)"""
+    return snapshots[-1].get('unused_indexes', [])
+
+def aggregate_connections(snapshots):
+    """Пиковое число подключений: всего и по базам данных"""
+    peak = {'connections': 0, 'active_connections': 0, 'ts': None}
+    by_database = {}
+
+    for snapshot in snapshots:
+        rows = snapshot.get('connections', [])
+        total = sum(row.get('connections') or 0 for row in rows)
+        if total > peak['connections']:
+            peak = {
+                'connections': total,
+                'active_connections': sum(row.get('active_connections') or 0 for row in rows),
+                'ts': snapshot['ts'],
+            }
+        for row in rows:
+            datname = row.get('datname') or '(фоновые процессы)'
+            current = by_database.get(datname)
+            if current is None or (row.get('connections') or 0) > current['connections']:
+                by_database[datname] = {
+                    'datname': datname,
+                    'connections': row.get('connections') or 0,
+                    'active_connections': row.get('active_connections') or 0,
+                    'ts': snapshot['ts'],
+                }
+
+    return {
+        'peak': peak,
+        'by_database': sorted(by_database.values(), key=lambda x: x['connections'], reverse=True),
+    }
+
+def aggregate_cache_hit(snapshots):
+    """Минимальный cache hit ratio на интервалах между соседними снимками"""
+    minimum = None
+    by_database = {}
+
+    for previous, current in zip(snapshots, snapshots[1:]):
+        before = {row['datname']: row for row in previous.get('databases', [])}
+        total_hit = total_read = 0
+        for row in current.get('databases', []):
+            old = before.get(row['datname'])
+            if old is None:
+                continue
+            hit = counter_delta(row['blks_hit'], old['blks_hit'])
+            read = counter_delta(row['blks_read'], old['blks_read'])
+            total_hit += hit
+            total_read += read
+            if hit + read == 0:
+                continue
+            ratio = round(100.0 * hit / (hit + read), 2)
+            known = by_database.get(row['datname'])
+            if known is None or ratio < known['cache_hit_ratio']:
+                by_database[row['datname']] = {
+                    'datname': row['datname'],
+                    'cache_hit_ratio': ratio,
+                    'blocks_read': read,
+                    'ts': current['ts'],
+                }
+        if total_hit + total_read == 0:
+            continue
+        ratio = round(100.0 * total_hit / (total_hit + total_read), 2)
+        if minimum is None or ratio < minimum['cache_hit_ratio']:
+            minimum = {'cache_hit_ratio': ratio, 'from': previous['ts'], 'ts': current['ts']}
+
+    return {
+        'minimum': minimum,
+        'by_database': sorted(by_database.values(), key=lambda x: x['cache_hit_ratio']),
+    }
+
+def aggregate_write_path(snapshots):
+    """WAL, контрольные точки и запись буферов за день по замерам write_path соседних снимков"""
+    samples = [(snapshot['ts'], snapshot['write_path']) for snapshot in snapshots if snapshot.get('write_path')]
+    if len(samples) < 2:
+        return None
+
+    seconds = 0.0
+    wal_bytes = 0
+    peak = None
+    checkpoints = requested = 0
+    checkpoint_time = 0.0
+    timed_checkpoints = 0
+    include_skipped = False
+    buffers = {'checkpointer': 0, 'bgwriter': 0, 'backends': 0}
+    replicas = {}
+
+    for (_, previous), (ts, current) in zip(samples, samples[1:]):
+        rates = compute_write_path_rates(previous, current)
+        seconds += rates['elapsed_seconds']
+        # Интервалы со сбросом статистики или сменой роли сервера дают None и пропускаются
+        if rates['wal_bytes'] is not None:
+            wal_bytes += rates['wal_bytes']
+            if peak is None or (rates['wal_bytes_per_second'] or 0) > peak['wal_bytes_per_second']:
+                peak = {'wal_bytes_per_second': rates['wal_bytes_per_second'] or 0, 'from': rates['from'], 'ts': ts}
+        if rates['checkpoints'] is not None:
+            checkpoints += rates['checkpoints']
+            requested += rates['checkpoints_requested'] or 0
+            include_skipped = include_skipped or rates['checkpoints_include_skipped']
+            if rates['checkpoint_avg_duration_ms'] is not None:
+                checkpoint_time += rates['checkpoint_avg_duration_ms'] * rates['checkpoints']
+                timed_checkpoints += rates['checkpoints']
+        for name, item in rates['buffers_written'].items():
+            buffers[name] += item['buffers'] or 0
+        for replica in current.get('replicas', []):
+            name = replica['application_name'] or replica['client_addr'] or 'local'
+            lag = replica.get('replay_lag_bytes') or 0
+            if name not in replicas or lag > replicas[name]['replay_lag_bytes']:
+                replicas[name] = {'application_name': name, 'replay_lag_bytes': lag, 'ts': ts}
+
+    hours = seconds / 3600
+    return {
+        'intervals': len(samples) - 1,
+        'wal_bytes': wal_bytes,
+        'wal_bytes_per_second': round(wal_bytes / seconds, 2) if seconds > 0 else None,
+        'peak': peak,
+        'checkpoints': checkpoints,
+        'checkpoints_requested': requested,
+        'checkpoints_per_hour': round(checkpoints / hours, 2) if hours > 0 else None,
+        'checkpoint_avg_duration_ms': round(checkpoint_time / timed_checkpoints, 1) if timed_checkpoints else None,
+        'checkpoints_include_skipped': include_skipped,
+        'buffers_written': {name: {'buffers': value, 'share': share(value, buffers.values())}
+                            for name, value in buffers.items()},
+        'replicas': sorted(replicas.values(), key=lambda x: x['replay_lag_bytes'], reverse=True),
+    }
+
+def previous_day_baseline(day, first_snapshot):
+    """Последний снимок предыдущего дня того же сервера, если он есть"""
+    previous_day = (date.fromisoformat(day) - timedelta(days=1)).isoformat()
+    snapshots = load_snapshots(previous_day)
+    if not snapshots or snapshots[-1].get('database') != first_snapshot.get('database'):
+        return None
+    return snapshots[-1]
+
+def build_daily_report(day):
+    """Построение отчёта за день только из сохранённых снимков, без запросов к серверу"""
+    snapshots = load_snapshots(day)
+    if not snapshots:
+        return {'success': False, 'error': f'Нет снимков за {day}'}
+
+    top_by_time, top_by_io = aggregate_statements(snapshots, previous_day_baseline(day, snapshots[0]))
+
+    return {
+        'day': day,
+        'generated_at': datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+        'snapshots_count': len(snapshots),
+        'period_start': snapshots[0]['ts'],
+        'period_end': snapshots[-1]['ts'],
+        'database': snapshots[-1].get('database'),
+        'top_statements_by_time': top_by_time,
+        'top_statements_by_io': top_by_io,
+        'dead_tuple_growth': aggregate_tables(snapshots),
+        'unused_indexes': aggregate_unused_indexes(snapshots),
+        'connection_peaks': aggregate_connections(snapshots),
+        'cache_hit_min': aggregate_cache_hit(snapshots),
+        'write_path': aggregate_write_path(snapshots),
+        'success': True
+    }
+
+def report_dir(day):
+    return os.path.join(REPORTS_DIR, day)
+
+def write_report(report):
+    """Сохранение готового отчёта: JSON, статический HTML и Parquet (если есть pyarrow)"""
+    try:
+        path = report_dir(report['day'])
+        os.makedirs(path, exist_ok=True)
+
+        # HTML пишем первым: JSON служит признаком готового отчёта
+        with open(os.path.join(path, 'report.html'), 'w', encoding='utf-8') as f:
+            f.write(render_report_html(report))
+
+        write_report_parquet(report, path)
+
+        tmp_path = os.path.join(path, 'report.json.tmp')
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(report, f, ensure_ascii=False, default=str)
+        os.replace(tmp_path, os.path.join(path, 'report.json'))
+        return True
+    except Exception as e:
+        print(f"Ошибка сохранения отчёта: {e}")
+        return False
+
+def render_report_html(report):
+    """Самодостаточная HTML-версия отчёта"""
+    from jinja2 import Environment, FileSystemLoader, select_autoescape
+
+    env = Environment(loader=FileSystemLoader(TEMPLATES_DIR), autoescape=select_autoescape(['html']))
+    return env.get_template('daily_report.html').render(report=report)
+
+def write_report_parquet(report, path):
+    """Секции отчёта в Parquet для внешнего анализа; без pyarrow пропускается"""
+    try:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+    except ImportError:
+        return False
+
+    for section in PARQUET_SECTIONS:
+        rows = report.get(section) or []
+        if rows:
+            pq.write_table(pa.Table.from_pylist(rows), os.path.join(path, f"{section}.parquet"))
+    return True
+
+def load_report(day):
+    """Готовый отчёт за день из кэша в памяти или с диска"""
+    path = os.path.join(report_dir(day), 'report.json')
+    try:
+        mtime = os.path.getmtime(path)
+    except OSError:
+        return None
+
+    cached = _report_cache.get(day)
+    if cached and cached[0] == mtime:
+        return cached[1]
+
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            report = json.load(f)
+    except (OSError, json.JSONDecodeError) as e:
+        print(f"Ошибка загрузки отчёта {path}: {e}")
+        return None
+
+    _report_cache[day] = (mtime, report)
+    return report
+
+def list_reports():
+    """Список дней с готовыми отчётами (новые первыми)"""
+    if not os.path.isdir(REPORTS_DIR):
+        return []
+    days = [name for name in os.listdir(REPORTS_DIR)
+            if os.path.exists(os.path.join(REPORTS_DIR, name, 'report.json'))]
+    return sorted(days, reverse=True)
+
+def is_valid_day(day):
+    """Проверка формата дня YYYY-MM-DD (день используется в путях к файлам)"""
+    try:
+        return datetime.strptime(day, '%Y-%m-%d').strftime('%Y-%m-%d') == day
+    except (TypeError, ValueError):
+        return False
+
+def build_and_write(day):
+    report = build_daily_report(day)
+    if report['success'] and not write_report(report):
+        return {'success': False, 'error': 'Ошибка сохранения отчёта'}
+    return report
+
+if __name__ == '__main__':
+    # Запуск раз в сутки (cron): python reports.py --day 2025-01-31
+    parser = argparse.ArgumentParser(description='Построение ежедневного отчёта из сохранённых снимков')
+    parser.add_argument('--day', default=date.today().isoformat(), help='день в формате YYYY-MM-DD')
+    parser.add_argument('--all', action='store_true', help='перестроить отчёты за все дни со снимками')
+    args = parser.parse_args()
+
+    days = list_snapshot_days() if args.all else [args.day]
+    for day in days:
+        if not is_valid_day(day):
+            raise SystemExit(f"Некорректный день: {day}")
+        report = build_and_write(day)
+        if report['success']:
+            print(f"Отчёт за {day} сохранён в {report_dir(day)}")
+        else:
+            print(f"Отчёт за {day} не построен: {report['error']}")
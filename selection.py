@@ -0,0 +1,9 @@
+import numpy as np
+
+def smallest(values, limit):
+    """Номера limit наименьших значений без полной сортировки"""
+    limit = min(limit, len(values))
+    if limit == 0:
+        return np.empty(0, dtype=np.int64)
+    candidates = np.argpartition(values, limit - 1)[:limit]
+    return candidates[np.argsort(values[candidates])]
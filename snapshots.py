@@ -0,0 +1,155 @@
+import json
+import os
+
+import psycopg2
+
+from write_path import sample_write_path
+
+# Пути считаются от каталога проекта: collector.py может запускаться из любого каталога
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+CONFIG_FILE = os.path.join(BASE_DIR, 'config.json')
+SQL_DIR = os.path.join(BASE_DIR, 'sql')
+# Каталог данных можно вынести (например, общий с collector.py на другом хосте)
+DATA_DIR = os.environ.get('PG_MONITOR_DATA_DIR', os.path.join(BASE_DIR, 'data'))
+SNAPSHOTS_DIR = os.path.join(DATA_DIR, 'snapshots')
+
+# Версии, для которых есть sql/<версия>_pg_stat_statements.sql
+SUPPORTED_VERSIONS = (13, 14, 15, 16, 17, 18)
+
+def load_sql(name):
+    """Чтение SQL-файла из каталога sql/ и разбиение на отдельные запросы"""
+    with open(os.path.join(SQL_DIR, name), 'r', encoding='utf-8') as f:
+        content = f.read()
+    return [statement.strip() for statement in content.split(';') if statement.strip()]
+
+def get_server_major_version(cursor):
+    """Мажорная версия сервера PostgreSQL (13, 14, ...)"""
+    cursor.execute("SHOW server_version_num;")
+    return int(cursor.fetchone()[0]) // 10000
+
+def statements_sql_file(major_version):
+    """Имя SQL-файла pg_stat_statements для версии сервера"""
+    version = min(max(major_version, SUPPORTED_VERSIONS[0]), SUPPORTED_VERSIONS[-1])
+    return f"{version}_pg_stat_statements.sql"
+
+def fetch_dicts(cursor, query):
+    """Выполнение запроса и возврат строк в виде словарей"""
+    cursor.execute(query)
+    columns = [desc[0] for desc in cursor.description]
+    return [dict(zip(columns, row)) for row in cursor.fetchall()]
+
+def take_snapshot(connection_string):
+    """Снимок счётчиков сервера для последующей офлайн-агрегации"""
+    try:
+        conn = psycopg2.connect(connection_string)
+        cursor = conn.cursor()
+
+        cursor.execute("SELECT now(), current_database();")
+        ts, database = cursor.fetchone()
+        major_version = get_server_major_version(cursor)
+
+        snapshot = {
+            'ts': ts.isoformat(),
+            'database': database,
+            'server_version': major_version,
+            'statements': [],
+            'tables': fetch_dicts(cursor, load_sql('statistics_by_tables.sql')[0]),
+            'unused_indexes': fetch_dicts(cursor, load_sql('indexes.sql')[0]),
+            'connections': fetch_dicts(cursor, load_sql('number_of_connections_to_db.sql')[0]),
+            'databases': fetch_dicts(cursor, """
+                SELECT datname, blks_hit, blks_read, xact_commit, xact_rollback
+                FROM pg_stat_database
+                WHERE datname IS NOT NULL;
+            """),
+        }
+
+        # Ошибка замера пути записи (например, нет прав на pg_stat_replication) не отменяет снимок
+        try:
+            snapshot['write_path'] = sample_write_path(cursor, major_version)
+        except psycopg2.Error as e:
+            conn.rollback()
+            snapshot['write_path'] = None
+            print(f"Снимок без замера WAL: {e}")
+
+        cursor.execute("SELECT 1 FROM pg_extension WHERE extname = 'pg_stat_statements';")
+        if cursor.fetchone() is not None:
+            snapshot['statements'] = fetch_dicts(cursor, load_sql(statements_sql_file(major_version))[0])
+
+        cursor.close()
+        conn.close()
+
+        snapshot['success'] = True
+        return snapshot
+    except Exception as e:
+        return {
+            'success': False,
+            'error': str(e)
+        }
+
+def snapshot_path(day):
+    """Путь к файлу снимков за день (NDJSON, один снимок на строку)"""
+    return os.path.join(SNAPSHOTS_DIR, f"{day}.ndjson")
+
+def save_snapshot(snapshot):
+    """Дописывание снимка в файл за соответствующий день"""
+    try:
+        record = {key: value for key, value in snapshot.items() if key != 'success'}
+        day = record['ts'][:10]
+        os.makedirs(SNAPSHOTS_DIR, exist_ok=True)
+        with open(snapshot_path(day), 'a', encoding='utf-8') as f:
+            f.write(json.dumps(record, ensure_ascii=False, default=str) + '\n')
+        return True
+    except Exception as e:
+        print(f"Ошибка сохранения снимка: {e}")
+        return False
+
+def load_snapshots(day):
+    """Загрузка всех снимков за день в порядке записи"""
+    path = snapshot_path(day)
+    if not os.path.exists(path):
+        return []
+
+    snapshots = []
+    with open(path, 'r', encoding='utf-8') as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                snapshots.append(json.loads(line))
+            except json.JSONDecodeError as e:
+                # Недописанная строка (например, при аварийной остановке) не должна ломать отчёт
+                print(f"Пропущена повреждённая строка в {path}: {e}")
+    return snapshots
+
+def list_snapshot_days():
+    """Список дней, за которые есть снимки (новые первыми)"""
+    if not os.path.isdir(SNAPSHOTS_DIR):
+        return []
+    days = [name[:-len('.ndjson')] for name in os.listdir(SNAPSHOTS_DIR) if name.endswith('.ndjson')]
+    return sorted(days, reverse=True)
+
+def load_connection_string():
+    """Строка подключения из config.json"""
+    try:
+        with open(CONFIG_FILE, 'r', encoding='utf-8') as f:
+            return json.load(f).get('postgres', {}).get('connection_string')
+    except (OSError, json.JSONDecodeError) as e:
+        print(f"Ошибка загрузки конфигурации: {e}")
+        return None
+
+if __name__ == '__main__':
+    # Запуск по расписанию (cron): python snapshots.py
+    connection_string = load_connection_string()
+    if not connection_string:
+        raise SystemExit("Подключение не настроено: заполните config.json через страницу Подключение к Postgres")
+
+    snapshot = take_snapshot(connection_string)
+    if not snapshot['success']:
+        raise SystemExit(f"Ошибка снятия снимка: {snapshot['error']}")
+
+    if save_snapshot(snapshot):
+        print(f"Снимок сохранён: {snapshot_path(snapshot['ts'][:10])}")
+
+    from archive import append_snapshot
+    append_snapshot(snapshot)
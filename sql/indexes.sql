@@ -1,18 +1,18 @@
 -- Неиспользуемые индексы
 SELECT 
     schemaname,
-    tablename,
-    indexname,
+    relname as tablename,
+    indexrelname as indexname,
     idx_scan as index_scans
 FROM pg_stat_user_indexes 
 WHERE idx_scan = 0 
-ORDER BY schemaname, tablename;
+ORDER BY schemaname, relname;
 
 -- Статистика использования индексов
 SELECT 
     schemaname,
-    tablename,
-    indexname,
+    relname as tablename,
+    indexrelname as indexname,
     idx_scan,
     idx_tup_read,
     idx_tup_fetch
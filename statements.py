@@ -0,0 +1,162 @@
+import time
+
+import numpy as np
+
+from selection import smallest
+
+PER_PAGE = 50
+QUERY_PREVIEW_LENGTH = 100
+
+# Весь набор pg_stat_statements одним запросом: все рейтинги и фильтры считаются по этому снимку
+STATEMENTS_SQL = """
+SELECT
+    s.userid,
+    s.dbid,
+    s.queryid,
+    s.query,
+    d.datname,
+    r.rolname as usename,
+    s.calls,
+    s.total_exec_time,
+    s.mean_exec_time,
+    s.rows,
+    s.shared_blks_hit,
+    s.shared_blks_read,
+    s.temp_blks_read,
+    s.temp_blks_written
+FROM pg_stat_statements s
+LEFT JOIN pg_database d ON d.oid = s.dbid
+LEFT JOIN pg_roles r ON r.oid = s.userid
+WHERE s.query NOT LIKE '%pg_stat_statements%';
+"""
+
+NUMERIC_COLUMNS = (
+    'userid', 'dbid', 'queryid', 'calls', 'total_exec_time', 'mean_exec_time', 'rows',
+    'shared_blks_hit', 'shared_blks_read', 'temp_blks_read', 'temp_blks_written',
+)
+INTEGER_COLUMNS = ('userid', 'dbid', 'queryid')
+
+def sample_statements(cursor):
+    """Снимок pg_stat_statements: счётчики в колонках NumPy, тексты запросов — списком"""
+    cursor.execute(STATEMENTS_SQL)
+    names = [desc[0] for desc in cursor.description]
+    rows = cursor.fetchall()
+    columns = dict(zip(names, zip(*rows))) if rows else {name: () for name in names}
+
+    sample = {'taken_at': time.time(), 'count': len(rows)}
+    for name in NUMERIC_COLUMNS:
+        dtype = np.int64 if name in INTEGER_COLUMNS else np.float64
+        sample[name] = np.array([value or 0 for value in columns[name]], dtype=dtype)
+    sample['query'] = [value or '' for value in columns['query']]
+    # Для поиска по тексту: приводим к нижнему регистру один раз при снятии снимка
+    sample['query_lower'] = [value.lower() for value in sample['query']]
+
+    sample['databases'] = sorted({(dbid, name or str(dbid)) for dbid, name in zip(columns['dbid'], columns['datname'])},
+                                 key=lambda item: item[1])
+    sample['users'] = sorted({(userid, name or str(userid)) for userid, name in zip(columns['userid'], columns['usename'])},
+                             key=lambda item: item[1])
+    sample['database_names'] = dict(sample['databases'])
+    sample['user_names'] = dict(sample['users'])
+    return sample
+
+def mean_time(sample):
+    return sample['mean_exec_time']
+
+def total_time(sample):
+    return sample['total_exec_time']
+
+def calls(sample):
+    return sample['calls']
+
+def disk_reads(sample):
+    return sample['shared_blks_read']
+
+def temp_blocks(sample):
+    return sample['temp_blks_read'] + sample['temp_blks_written']
+
+def rows_per_call(sample):
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return np.where(sample['calls'] > 0, sample['rows'] / sample['calls'], np.nan)
+
+def cache_hit_ratio(sample):
+    # Запросы без обращений к shared-буферам в рейтинг кеша не попадают (nan)
+    blocks = sample['shared_blks_hit'] + sample['shared_blks_read']
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return np.where(blocks > 0, 100.0 * sample['shared_blks_hit'] / blocks, np.nan)
+
+# Рейтинги: имя -> (заголовок, значения по снимку, худшие — наибольшие)
+RANKINGS = {
+    'total_time': ('по общему времени выполнения', total_time, True),
+    'mean_time': ('по среднему времени выполнения', mean_time, True),
+    'calls': ('по числу вызовов', calls, True),
+    'disk_reads': ('по чтениям с диска', disk_reads, True),
+    'temp_blocks': ('по временным блокам', temp_blocks, True),
+    'rows_per_call': ('по числу строк за вызов', rows_per_call, True),
+    'cache_hit_ratio': ('по наименьшему проценту попаданий в кеш', cache_hit_ratio, False),
+}
+DEFAULT_RANKING = 'total_time'
+
+def filter_mask(sample, dbid=None, userid=None, pattern=None):
+    """Маска запросов по базе, пользователю и подстроке текста (без учёта регистра)"""
+    mask = np.ones(sample['count'], dtype=bool)
+    if dbid is not None:
+        mask &= sample['dbid'] == dbid
+    if userid is not None:
+        mask &= sample['userid'] == userid
+    if pattern:
+        needle = pattern.lower()
+        mask &= np.fromiter((needle in text for text in sample['query_lower']), dtype=bool, count=sample['count'])
+    return mask
+
+def statement_row(sample, i, ratio):
+    """Строка для шаблона в прежнем формате get_problematic_queries"""
+    query = sample['query'][i]
+    calls_count = sample['calls'][i].item()
+    return {
+        'queryid': sample['queryid'][i].item(),
+        'query': query,
+        'short_query': query[:QUERY_PREVIEW_LENGTH] + '...' if len(query) > QUERY_PREVIEW_LENGTH else query,
+        'dbid': sample['dbid'][i].item(),
+        'userid': sample['userid'][i].item(),
+        'datname': sample['database_names'].get(sample['dbid'][i].item()),
+        'usename': sample['user_names'].get(sample['userid'][i].item()),
+        'total_calls': int(calls_count),
+        'total_time': sample['total_exec_time'][i].item(),
+        'avg_time': sample['mean_exec_time'][i].item(),
+        'rows_processed': int(sample['rows'][i]),
+        'rows_per_call': sample['rows'][i].item() / calls_count if calls_count else None,
+        'cache_hits': int(sample['shared_blks_hit'][i]),
+        'disk_reads': int(sample['shared_blks_read'][i]),
+        'temp_blocks': int(sample['temp_blks_read'][i] + sample['temp_blks_written'][i]),
+        'cache_hit_ratio': None if np.isnan(ratio[i]) else ratio[i].item(),
+    }
+
+def rank_statements(sample, ranking=DEFAULT_RANKING, dbid=None, userid=None, pattern=None,
+                    page=1, per_page=PER_PAGE):
+    """Страница рейтинга по снимку: отбор top-N через argpartition, без запроса к серверу"""
+    # Неизвестный рейтинг из адреса страницы не должен ломать её
+    if ranking not in RANKINGS:
+        ranking = DEFAULT_RANKING
+    title, metric, descending = RANKINGS[ranking]
+
+    values = metric(sample)
+    candidates = np.flatnonzero(filter_mask(sample, dbid, userid, pattern) & ~np.isnan(values))
+    total = len(candidates)
+    pages = max((total + per_page - 1) // per_page, 1)
+    page = min(max(page, 1), pages)
+
+    # Упорядочиваем только первые page * per_page значений, остальные не сортируются
+    keys = -values[candidates] if descending else values[candidates]
+    top = candidates[smallest(keys, page * per_page)]
+    ratio = cache_hit_ratio(sample)
+
+    return {
+        'queries': [statement_row(sample, i, ratio) for i in top[(page - 1) * per_page:]],
+        'total_queries': total,
+        'statements_count': sample['count'],
+        'ranking': ranking,
+        'ranking_title': title,
+        'page': page,
+        'pages': pages,
+        'per_page': per_page,
+    }
@@ -0,0 +1,222 @@
+import numpy as np
+
+from selection import smallest
+
+# Сглаживание скорости роста dead tuples между замерами (экспоненциальное среднее)
+RATE_SMOOTHING = 0.3
+# Жёсткий предел возраста XID, после которого сервер перестаёт выдавать транзакции
+XID_WRAPAROUND_LIMIT = 2 ** 31 - 1
+TOP_N = 50
+
+# Порог автовакуума считается на сервере: reloptions таблицы важнее глобальных настроек
+VACUUM_TABLES_SQL = """
+SELECT
+    s.relid,
+    s.schemaname,
+    s.relname as table_name,
+    s.n_live_tup as live_rows,
+    s.n_dead_tup as dead_rows,
+    s.n_ins_since_vacuum as inserts_since_vacuum,
+    s.last_autovacuum,
+    s.last_vacuum,
+    s.autovacuum_count,
+    s.vacuum_count,
+    age(c.relfrozenxid) as xid_age,
+    COALESCE(o.autovacuum_enabled, 'on') IN ('on', 'true', 'yes', '1') as autovacuum_enabled,
+    COALESCE(o.vacuum_threshold, current_setting('autovacuum_vacuum_threshold'))::float8
+        + COALESCE(o.vacuum_scale_factor, current_setting('autovacuum_vacuum_scale_factor'))::float8
+          * greatest(c.reltuples, 0) as vacuum_threshold,
+    COALESCE(o.vacuum_max_threshold, current_setting('autovacuum_vacuum_max_threshold', true), '-1')::float8
+        as vacuum_max_threshold,
+    COALESCE(o.insert_threshold, current_setting('autovacuum_vacuum_insert_threshold'))::float8
+        + COALESCE(o.insert_scale_factor, current_setting('autovacuum_vacuum_insert_scale_factor'))::float8
+          * greatest(c.reltuples, 0) as insert_threshold,
+    least(COALESCE(o.freeze_max_age, current_setting('autovacuum_freeze_max_age'))::bigint,
+          current_setting('autovacuum_freeze_max_age')::bigint) as freeze_max_age,
+    p.pid as vacuum_pid,
+    p.phase as vacuum_phase,
+    p.heap_blks_total,
+    p.heap_blks_scanned
+FROM pg_stat_user_tables s
+JOIN pg_class c ON c.oid = s.relid
+-- pg_stat_progress_vacuum показывает вакуум во всех базах, а OID таблиц в разных базах совпадают
+LEFT JOIN pg_stat_progress_vacuum p ON p.relid = s.relid
+    AND p.datid = (SELECT oid FROM pg_database WHERE datname = current_database())
+LEFT JOIN LATERAL (
+    SELECT
+        max(option_value) FILTER (WHERE option_name = 'autovacuum_enabled') as autovacuum_enabled,
+        max(option_value) FILTER (WHERE option_name = 'autovacuum_vacuum_threshold') as vacuum_threshold,
+        max(option_value) FILTER (WHERE option_name = 'autovacuum_vacuum_scale_factor') as vacuum_scale_factor,
+        max(option_value) FILTER (WHERE option_name = 'autovacuum_vacuum_max_threshold') as vacuum_max_threshold,
+        max(option_value) FILTER (WHERE option_name = 'autovacuum_vacuum_insert_threshold') as insert_threshold,
+        max(option_value) FILTER (WHERE option_name = 'autovacuum_vacuum_insert_scale_factor') as insert_scale_factor,
+        max(option_value) FILTER (WHERE option_name = 'autovacuum_freeze_max_age') as freeze_max_age
+    FROM pg_options_to_table(c.reloptions)
+) o ON true
+ORDER BY s.relid;
+"""
+
+VACUUM_SERVER_SQL = """
+SELECT
+    extract(epoch from clock_timestamp())::float8 as ts,
+    pg_snapshot_xmax(pg_current_snapshot())::text::bigint as next_xid,
+    current_setting('autovacuum') = 'on' as autovacuum,
+    current_setting('autovacuum_max_workers')::int as autovacuum_max_workers,
+    (SELECT count(*) FROM pg_stat_activity WHERE backend_type = 'autovacuum worker') as autovacuum_workers;
+"""
+
+# Числовые колонки, которые переводятся в массивы NumPy
+NUMERIC_COLUMNS = (
+    'relid', 'live_rows', 'dead_rows', 'inserts_since_vacuum', 'autovacuum_count', 'vacuum_count',
+    'xid_age', 'vacuum_threshold', 'vacuum_max_threshold', 'insert_threshold', 'freeze_max_age',
+    'heap_blks_total', 'heap_blks_scanned', 'vacuum_pid',
+)
+
+def sample_vacuum(cursor):
+    """Замер состояния автовакуума по всем таблицам: строки в колонках NumPy"""
+    cursor.execute(VACUUM_SERVER_SQL)
+    server = dict(zip([desc[0] for desc in cursor.description], cursor.fetchone()))
+
+    cursor.execute(VACUUM_TABLES_SQL)
+    names = [desc[0] for desc in cursor.description]
+    rows = cursor.fetchall()
+    columns = dict(zip(names, zip(*rows))) if rows else {name: () for name in names}
+
+    tables = {}
+    for name in names:
+        if name in NUMERIC_COLUMNS:
+            # NULL (нет записи в pg_stat_progress_vacuum, n_ins_since_vacuum и т.п.) -> 0
+            tables[name] = np.array([value or 0 for value in columns[name]], dtype=np.float64)
+        else:
+            tables[name] = columns[name]
+    tables['relid'] = tables['relid'].astype(np.int64)
+
+    return {'server': server, 'tables': tables, 'count': len(rows)}
+
+def new_vacuum_state():
+    """Состояние прогноза между замерами: массивы, выровненные по отсортированным relid"""
+    return {
+        'ts': None,
+        'next_xid': None,
+        'xid_rate': None,
+        'relid': np.empty(0, dtype=np.int64),
+        'dead_rows': np.empty(0),
+        'vacuums': np.empty(0),
+        'rate': np.empty(0),
+    }
+
+def update_vacuum_state(state, sample):
+    """Инкрементальное обновление скоростей роста dead tuples по новому замеру"""
+    server = sample['server']
+    tables = sample['tables']
+    relid = tables['relid']
+    dead_rows = tables['dead_rows']
+    vacuums = tables['autovacuum_count'] + tables['vacuum_count']
+
+    # Сопоставление таблиц с прошлым замером без цикла по таблицам: relid отсортированы
+    previous_relid = state['relid']
+    if len(previous_relid):
+        position = np.minimum(np.searchsorted(previous_relid, relid), len(previous_relid) - 1)
+        matched = previous_relid[position] == relid
+    else:
+        position = np.zeros(len(relid), dtype=np.int64)
+        matched = np.zeros(len(relid), dtype=bool)
+
+    rate = np.full(len(relid), np.nan)
+    if state['ts'] is not None and server['ts'] > state['ts'] and matched.any():
+        seconds = server['ts'] - state['ts']
+        previous_dead = state['dead_rows'][position]
+        previous_rate = state['rate'][position]
+        rate[matched] = previous_rate[matched]
+
+        # Рост считаем только там, где vacuum не прошёл: после него dead tuples падают
+        growing = matched & (vacuums == state['vacuums'][position]) & (dead_rows >= previous_dead)
+        current_rate = (dead_rows - previous_dead) / seconds
+        smoothed = np.where(np.isnan(previous_rate), current_rate,
+                            RATE_SMOOTHING * current_rate + (1 - RATE_SMOOTHING) * previous_rate)
+        rate[growing] = smoothed[growing]
+
+        if state['next_xid'] is not None and server['next_xid'] >= state['next_xid']:
+            current_xid_rate = (server['next_xid'] - state['next_xid']) / seconds
+            state['xid_rate'] = current_xid_rate if state['xid_rate'] is None else (
+                RATE_SMOOTHING * current_xid_rate + (1 - RATE_SMOOTHING) * state['xid_rate'])
+
+    state.update({
+        'ts': server['ts'],
+        'next_xid': server['next_xid'],
+        'relid': relid,
+        'dead_rows': dead_rows,
+        'vacuums': vacuums,
+        'rate': rate,
+    })
+    return state
+
+def select_rows(tables, indexes, extra):
+    """Строки для отображения по номерам таблиц в замере"""
+    rows = []
+    for i in indexes:
+        row = {name: (values[i].item() if isinstance(values, np.ndarray) else values[i])
+               for name, values in tables.items()}
+        row.update({name: values[i].item() for name, values in extra.items()})
+        rows.append(row)
+    return rows
+
+def forecast_vacuum(state, sample, limit=TOP_N):
+    """Прогноз: когда таблицы пересекут порог автовакуума и насколько близок wraparound"""
+    server = sample['server']
+    tables = sample['tables']
+    dead_rows = tables['dead_rows']
+
+    threshold = tables['vacuum_threshold']
+    max_threshold = tables['vacuum_max_threshold']
+    # autovacuum_vacuum_max_threshold (18+) ограничивает порог для больших таблиц
+    threshold = np.where(max_threshold > 0, np.minimum(threshold, max_threshold), threshold)
+
+    rate = state['rate']
+    remaining = threshold - dead_rows
+    with np.errstate(divide='ignore', invalid='ignore'):
+        seconds_to_threshold = np.where(remaining <= 0, 0.0,
+                                        np.where(rate > 0, remaining / rate, np.inf))
+        threshold_ratio = np.where(threshold > 0, 100.0 * dead_rows / threshold, 0.0)
+        insert_ratio = np.where(tables['insert_threshold'] > 0,
+                                100.0 * tables['inserts_since_vacuum'] / tables['insert_threshold'], 0.0)
+        vacuum_progress = np.where(tables['heap_blks_total'] > 0,
+                                   100.0 * tables['heap_blks_scanned'] / tables['heap_blks_total'], 0.0)
+
+    freeze_ratio = 100.0 * tables['xid_age'] / tables['freeze_max_age']
+    wraparound_ratio = 100.0 * tables['xid_age'] / XID_WRAPAROUND_LIMIT
+    xid_rate = state['xid_rate']
+    if xid_rate:
+        seconds_to_freeze = np.maximum(tables['freeze_max_age'] - tables['xid_age'], 0) / xid_rate
+    else:
+        seconds_to_freeze = np.full(len(dead_rows), np.inf)
+
+    in_progress = tables['vacuum_pid'] > 0
+    # Порог пройден, а вакуум таблицу не обрабатывает — автовакуум не успевает
+    overdue = (remaining <= 0) & ~in_progress & (dead_rows > 0)
+
+    extra = {
+        'vacuum_threshold': np.round(threshold),
+        'dead_rows_per_second': np.nan_to_num(rate, nan=0.0),
+        'seconds_to_threshold': seconds_to_threshold,
+        'threshold_ratio': np.round(threshold_ratio, 1),
+        'insert_ratio': np.round(insert_ratio, 1),
+        'vacuum_progress': np.round(vacuum_progress, 1),
+        'freeze_ratio': np.round(freeze_ratio, 1),
+        'wraparound_ratio': np.round(wraparound_ratio, 2),
+        'seconds_to_freeze': seconds_to_freeze,
+    }
+
+    return {
+        'tables_count': sample['count'],
+        'tables_with_rate': int(np.count_nonzero(~np.isnan(rate))),
+        'overdue_count': int(np.count_nonzero(overdue)),
+        'in_progress': select_rows(tables, np.flatnonzero(in_progress), extra),
+        'next_to_threshold': select_rows(tables, smallest(seconds_to_threshold, limit), extra),
+        'next_to_wraparound': select_rows(tables, smallest(-tables['xid_age'], limit), extra),
+        'max_freeze_ratio': float(freeze_ratio.max()) if len(freeze_ratio) else 0.0,
+        'xid_per_second': round(xid_rate, 2) if xid_rate else None,
+        'autovacuum': server['autovacuum'],
+        'autovacuum_workers': server['autovacuum_workers'],
+        'autovacuum_max_workers': server['autovacuum_max_workers'],
+    }
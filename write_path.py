@@ -0,0 +1,185 @@
+from datetime import datetime
+
+def to_int(value):
+    """numeric/Decimal из pg_wal_lsn_diff в int (None остаётся None)"""
+    return int(value) if value is not None else None
+
+def fetch_one_dict(cursor, query):
+    cursor.execute(query)
+    row = cursor.fetchone()
+    if row is None:
+        return {}
+    return dict(zip([desc[0] for desc in cursor.description], row))
+
+def sample_write_path(cursor, major_version):
+    """Замер счётчиков пути записи: WAL, контрольные точки, запись буферов, репликация"""
+    # pg_stat_wal есть с 14 версии; в 17 контрольные точки переехали в pg_stat_checkpointer,
+    # а запись буферов backend'ами — в pg_stat_io
+    cursor.execute("SELECT clock_timestamp(), pg_is_in_recovery();")
+    ts, in_recovery = cursor.fetchone()
+    sample = {'ts': ts.isoformat(), 'server_version': major_version, 'in_recovery': in_recovery}
+
+    if in_recovery:
+        row = fetch_one_dict(cursor, """
+            SELECT pg_last_wal_replay_lsn()::text as wal_lsn,
+                   pg_wal_lsn_diff(pg_last_wal_replay_lsn(), '0/0') as wal_position,
+                   extract(epoch from now() - pg_last_xact_replay_timestamp()) as replay_delay_seconds;
+        """)
+        row['replay_delay_seconds'] = float(row['replay_delay_seconds']) if row.get('replay_delay_seconds') is not None else None
+    else:
+        row = fetch_one_dict(cursor, """
+            SELECT pg_current_wal_lsn()::text as wal_lsn,
+                   pg_wal_lsn_diff(pg_current_wal_lsn(), '0/0') as wal_position;
+        """)
+    row['wal_position'] = to_int(row.get('wal_position'))
+    sample.update(row)
+
+    if major_version >= 17:
+        done_column = ', num_done as checkpoints_done' if major_version >= 18 else ''
+        sample.update(fetch_one_dict(cursor, f"""
+            SELECT num_timed as checkpoints_timed,
+                   num_requested as checkpoints_req,
+                   write_time as checkpoint_write_time,
+                   sync_time as checkpoint_sync_time,
+                   buffers_written as buffers_checkpoint{done_column}
+            FROM pg_stat_checkpointer;
+        """))
+        sample.update(fetch_one_dict(cursor, """
+            SELECT buffers_clean, maxwritten_clean, buffers_alloc
+            FROM pg_stat_bgwriter;
+        """))
+        sample.update(fetch_one_dict(cursor, """
+            SELECT COALESCE(sum(writes), 0)::bigint as buffers_backend
+            FROM pg_stat_io
+            WHERE object = 'relation'
+              AND backend_type NOT IN ('checkpointer', 'background writer');
+        """))
+    else:
+        sample.update(fetch_one_dict(cursor, """
+            SELECT checkpoints_timed, checkpoints_req,
+                   checkpoint_write_time, checkpoint_sync_time,
+                   buffers_checkpoint, buffers_clean, maxwritten_clean,
+                   buffers_backend, buffers_alloc
+            FROM pg_stat_bgwriter;
+        """))
+
+    if major_version >= 14:
+        wal = fetch_one_dict(cursor, """
+            SELECT wal_records, wal_fpi, wal_bytes, wal_buffers_full
+            FROM pg_stat_wal;
+        """)
+        wal['wal_bytes'] = to_int(wal.get('wal_bytes'))
+        sample.update(wal)
+
+    replicas = []
+    if not in_recovery:
+        cursor.execute("""
+            SELECT application_name,
+                   client_addr::text as client_addr,
+                   state,
+                   sync_state,
+                   pg_wal_lsn_diff(pg_current_wal_lsn(), sent_lsn) as sent_lag_bytes,
+                   pg_wal_lsn_diff(pg_current_wal_lsn(), replay_lsn) as replay_lag_bytes,
+                   pg_wal_lsn_diff(replay_lsn, '0/0') as replay_position,
+                   extract(epoch from write_lag) as write_lag_seconds,
+                   extract(epoch from flush_lag) as flush_lag_seconds,
+                   extract(epoch from replay_lag) as replay_lag_seconds
+            FROM pg_stat_replication;
+        """)
+        columns = [desc[0] for desc in cursor.description]
+        for values in cursor.fetchall():
+            replica = dict(zip(columns, values))
+            for key in ('sent_lag_bytes', 'replay_lag_bytes', 'replay_position'):
+                replica[key] = to_int(replica[key])
+            for key in ('write_lag_seconds', 'flush_lag_seconds', 'replay_lag_seconds'):
+                replica[key] = float(replica[key]) if replica[key] is not None else None
+            replicas.append(replica)
+    sample['replicas'] = replicas
+
+    return sample
+
+def counter_delta(current, previous, key):
+    """Приращение счётчика; None, если его нет или статистику сбросили"""
+    if current.get(key) is None or previous.get(key) is None:
+        return None
+    delta = current[key] - previous[key]
+    return delta if delta >= 0 else None
+
+def per_second(value, seconds):
+    return round(value / seconds, 2) if value is not None and seconds > 0 else None
+
+def share(part, parts):
+    known = [value for value in parts if value is not None]
+    if part is None or not known or sum(known) == 0:
+        return None
+    return round(100.0 * part / sum(known), 2)
+
+def compute_write_path_rates(previous, current):
+    """Скорости пути записи по разнице двух замеров"""
+    seconds = (datetime.fromisoformat(current['ts']) - datetime.fromisoformat(previous['ts'])).total_seconds()
+    rates = {
+        'elapsed_seconds': round(seconds, 1),
+        'from': previous['ts'],
+        'to': current['ts'],
+    }
+
+    wal_bytes = counter_delta(current, previous, 'wal_position')
+    rates['wal_bytes'] = wal_bytes
+    rates['wal_bytes_per_second'] = per_second(wal_bytes, seconds)
+
+    # Из pg_stat_wal: полные образы страниц и переполнения WAL-буферов
+    wal_records = counter_delta(current, previous, 'wal_records')
+    wal_fpi = counter_delta(current, previous, 'wal_fpi')
+    rates['wal_records_per_second'] = per_second(wal_records, seconds)
+    rates['wal_fpi_per_second'] = per_second(wal_fpi, seconds)
+    rates['wal_fpi_ratio'] = round(100.0 * wal_fpi / wal_records, 2) if wal_records and wal_fpi is not None else None
+    rates['wal_buffers_full'] = counter_delta(current, previous, 'wal_buffers_full')
+
+    timed = counter_delta(current, previous, 'checkpoints_timed')
+    requested = counter_delta(current, previous, 'checkpoints_req')
+    write_time = counter_delta(current, previous, 'checkpoint_write_time')
+    sync_time = counter_delta(current, previous, 'checkpoint_sync_time')
+    # В 18 версии num_done считает только выполненные контрольные точки
+    done = counter_delta(current, previous, 'checkpoints_done')
+    rates['checkpoints_include_skipped'] = False
+    if done is None and timed is not None and requested is not None:
+        # До 18 версии checkpoints_timed учитывает и пропущенные (на простаивающем сервере)
+        # контрольные точки: считаем их, только если контрольные точки что-то записали
+        worked = bool(write_time) or bool(counter_delta(current, previous, 'buffers_checkpoint'))
+        done = requested + (timed if worked else 0)
+        rates['checkpoints_include_skipped'] = worked and timed > 0
+    rates['checkpoints'] = done
+    rates['checkpoints_requested'] = requested
+    rates['checkpoints_per_hour'] = per_second(done * 3600 if done is not None else None, seconds)
+
+    if done and write_time is not None and sync_time is not None:
+        rates['checkpoint_avg_duration_ms'] = round((write_time + sync_time) / done, 1)
+        rates['checkpoint_avg_sync_ms'] = round(sync_time / done, 1)
+    else:
+        rates['checkpoint_avg_duration_ms'] = None
+        rates['checkpoint_avg_sync_ms'] = None
+
+    buffers = {
+        'checkpointer': counter_delta(current, previous, 'buffers_checkpoint'),
+        'bgwriter': counter_delta(current, previous, 'buffers_clean'),
+        'backends': counter_delta(current, previous, 'buffers_backend'),
+    }
+    rates['buffers_written'] = {
+        name: {
+            'buffers': value,
+            'per_second': per_second(value, seconds),
+            'share': share(value, buffers.values()),
+        }
+        for name, value in buffers.items()
+    }
+    rates['maxwritten_clean'] = counter_delta(current, previous, 'maxwritten_clean')
+
+    before = {(replica['application_name'], replica['client_addr']): replica for replica in previous.get('replicas', [])}
+    replicas = []
+    for replica in current.get('replicas', []):
+        old = before.get((replica['application_name'], replica['client_addr']))
+        replayed = counter_delta(replica, old, 'replay_position') if old else None
+        replicas.append(dict(replica, replay_bytes_per_second=per_second(replayed, seconds)))
+    rates['replicas'] = replicas
+
+    return rates